@@ -0,0 +1,156 @@
+"""
+Chunk-embed ingestion benchmark.
+
+    python benchmarks/bench_ingestion.py --chunks 2000 --uploads 5
+
+Measures `save_chunks_and_embeddings` throughput on synthetic chunks and
+end-to-end throughput on `chunk-embed/example.pdf` through the FastAPI app,
+one upload per `embed_file` request and all uploads in one `/bulk` request,
+against in-process fakes. Prints one JSON object.
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from jose import jwt
+from langchain_core.documents import Document
+
+from common import use_service, peak_rss_bytes, SERVICES_DIR
+from fakes import FakeSupabase, FakeEmbeddings, make_vocab, synthetic_text, seed_project
+
+use_service("chunk-embed")
+
+import main as chunk_embed  # noqa: E402
+from utils import security  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+def _token(user_id: str) -> str:
+    now = datetime.now(timezone.utc)
+    return jwt.encode(
+        {"sub": user_id, "aud": security.AUD, "iss": security.ISS, "iat": now, "exp": now + timedelta(hours=1)},
+        security._get_key(),
+        algorithm=security.ALG,
+    )
+
+
+def bench_save(db: FakeSupabase, n_chunks: int, chunk_chars: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    vocab = make_vocab(seed)
+    chunks = [Document(page_content=synthetic_text(rng, vocab, chunk_chars)) for _ in range(n_chunks)]
+    file_row = db.insert_row("files", {"name": "synthetic.pdf", "status": "processing"})
+    db.reset_counters()
+
+    t0 = time.perf_counter()
+    chunk_embed.save_chunks_and_embeddings(file_row["id"], chunks)
+    elapsed = time.perf_counter() - t0
+    return {
+        "chunks": n_chunks,
+        "elapsed_s": round(elapsed, 4),
+        "chunks_per_s": round(n_chunks / elapsed, 1) if elapsed else None,
+        "round_trips": dict(db.round_trips),
+        "embedding_calls": chunk_embed.embeddings_model.calls,
+    }
+
+
+def bench_embed_file(db: FakeSupabase, uploads: int) -> dict:
+    project = seed_project(db, n_chunks=0)
+    client = TestClient(chunk_embed.app)
+    headers = {"Authorization": f"Bearer {_token(project['owner_id'])}"}
+    pdf = (SERVICES_DIR / "chunk-embed" / "example.pdf").read_bytes()
+    db.reset_counters()
+    calls_before = chunk_embed.embeddings_model.calls
+
+    samples, total_chunks = [], 0
+    for i in range(uploads):
+        file_row = db.insert_row("files", {"project_id": project["project_id"], "name": f"upload-{i}.pdf", "status": "processing"})
+        t = time.perf_counter()
+        res = client.post("/", headers=headers, data={"file_id": file_row["id"]},
+                          files={"file": ("example.pdf", pdf, "application/pdf")})
+        samples.append(time.perf_counter() - t)
+        if res.status_code != 200:
+            # e.g. the tiktoken encoding is not cached and there is no network
+            return {"error": res.json().get("detail"), "status_code": res.status_code}
+        total_chunks += res.json()["chunks"]
+
+    elapsed = sum(samples)
+    return {
+        "uploads": uploads,
+        "chunks": total_chunks,
+        "elapsed_s": round(elapsed, 4),
+        "files_per_s": round(uploads / elapsed, 2) if elapsed else None,
+        "chunks_per_s": round(total_chunks / elapsed, 1) if elapsed else None,
+        "round_trips": dict(db.round_trips),
+        "embedding_calls": chunk_embed.embeddings_model.calls - calls_before,
+    }
+
+
+def bench_bulk(db: FakeSupabase, uploads: int) -> dict:
+    project = seed_project(db, n_chunks=0, seed=1)
+    client = TestClient(chunk_embed.app)
+    headers = {"Authorization": f"Bearer {_token(project['owner_id'])}"}
+    pdf = (SERVICES_DIR / "chunk-embed" / "example.pdf").read_bytes()
+    file_ids = [
+        db.insert_row("files", {"project_id": project["project_id"], "name": f"bulk-{i}.pdf", "status": "processing"})["id"]
+        for i in range(uploads)
+    ]
+    db.reset_counters()
+    calls_before = chunk_embed.embeddings_model.calls
+
+    t0 = time.perf_counter()
+    res = client.post("/bulk", headers=headers,
+                      data={"project_id": project["project_id"], "file_ids": file_ids},
+                      files=[("files", (f"bulk-{i}.pdf", pdf, "application/pdf")) for i in range(uploads)])
+    elapsed = time.perf_counter() - t0
+    if res.status_code != 200:
+        return {"error": res.json().get("detail"), "status_code": res.status_code}
+    body = res.json()
+    if body["failed"]:
+        return {"error": next(f["error"] for f in body["files"] if f["status"] == "failed")}
+
+    total_chunks = sum(f["chunks"] for f in body["files"])
+    return {
+        "uploads": uploads,
+        "chunks": total_chunks,
+        "elapsed_s": round(elapsed, 4),
+        "files_per_s": round(uploads / elapsed, 2) if elapsed else None,
+        "chunks_per_s": round(total_chunks / elapsed, 1) if elapsed else None,
+        "round_trips": dict(db.round_trips),
+        "embedding_calls": chunk_embed.embeddings_model.calls - calls_before,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", type=int, default=2000)
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--uploads", type=int, default=5)
+    ap.add_argument("--chunk-chars", type=int, default=1500)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="simulated Supabase round-trip time")
+    ap.add_argument("--embed-latency-ms", type=float, default=0.0, help="simulated embeddings API time")
+    ap.add_argument("--max-rows", type=int, default=1000, help="PostgREST db-max-rows (0 = unlimited)")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    db = FakeSupabase(latency_s=args.latency_ms / 1000.0, max_rows=args.max_rows or None)
+    chunk_embed.supabase = db
+    chunk_embed.embeddings_model = FakeEmbeddings(dim=args.dim, latency_s=args.embed_latency_ms / 1000.0)
+
+    save = bench_save(db, args.chunks, args.chunk_chars, args.seed)
+    embed_file = bench_embed_file(db, args.uploads) if args.uploads else None
+    bulk = bench_bulk(db, args.uploads) if args.uploads else None
+
+    print(json.dumps({
+        "bench": "ingestion",
+        "params": vars(args),
+        "save_chunks_and_embeddings": save,
+        "embed_file": embed_file,
+        "bulk": bulk,
+        "peak_rss_bytes": peak_rss_bytes(),
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Chat-service retrieval benchmark for a single synthetic project.
+
+    python benchmarks/bench_retrieval.py --chunks 10000 --queries 200
+
+Prints one JSON object: `_load_data` wall time, per-query latency of
+`_get_relevant_documents`, round trips issued against the fake Supabase and
+peak RSS of the process.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from common import use_service, rss_bytes, peak_rss_bytes, latency_summary
+from fakes import FakeSupabase, FakeEmbeddings, seed_project, synthetic_text
+
+use_service("chat")
+
+from retrievers.SupabaseRetriever import SupabaseRetriever  # noqa: E402
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", type=int, default=10_000)
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--chunk-chars", type=int, default=1500)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="simulated Supabase round-trip time")
+    ap.add_argument("--embed-latency-ms", type=float, default=0.0, help="simulated embeddings API time")
+    ap.add_argument("--max-rows", type=int, default=1000, help="PostgREST db-max-rows (0 = unlimited)")
+    ap.add_argument("--snapshot-dir", help="enable on-disk index snapshots; reports a cold and a warm load")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    db = FakeSupabase(latency_s=args.latency_ms / 1000.0, max_rows=args.max_rows or None)
+    project = seed_project(db, n_chunks=args.chunks, dim=args.dim, chunk_chars=args.chunk_chars, seed=args.seed)
+    embeddings = FakeEmbeddings(dim=args.dim, latency_s=args.embed_latency_ms / 1000.0)
+    rss_setup = rss_bytes()
+
+    t0 = time.perf_counter()
+    retriever = SupabaseRetriever(supabase=db, project_id=project["project_id"], embeddings_model=embeddings,
+                                  snapshot_dir=args.snapshot_dir)
+    load_s = time.perf_counter() - t0
+    load_round_trips = db.total_round_trips()
+    rss_loaded = rss_bytes()
+
+    snapshot = None
+    if args.snapshot_dir:
+        db.reset_counters()
+        t0 = time.perf_counter()
+        retriever = SupabaseRetriever(supabase=db, project_id=project["project_id"], embeddings_model=embeddings,
+                                      snapshot_dir=args.snapshot_dir)
+        snapshot = {"load_s": round(time.perf_counter() - t0, 4), "round_trips": db.total_round_trips()}
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = [synthetic_text(rng, project["vocab"], 60) for _ in range(args.queries)]
+    retriever._get_relevant_documents(queries[0])  # warm-up
+    samples = []
+    for q in queries:
+        t = time.perf_counter()
+        retriever._get_relevant_documents(q)
+        samples.append(time.perf_counter() - t)
+
+    print(json.dumps({
+        "bench": "retrieval",
+        "params": vars(args),
+        "chunks_seeded": project["chunks"],
+        "documents_loaded": len(retriever.store),
+        "load_data_s": round(load_s, 4),
+        "load_round_trips": load_round_trips,
+        "snapshot_load": snapshot,
+        "query": latency_summary(samples),
+        "rss_setup_bytes": rss_setup,
+        "rss_loaded_delta_bytes": rss_loaded - rss_setup,
+        "peak_rss_bytes": peak_rss_bytes(),
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import os
+import sys
+import resource
+import subprocess
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+SERVICES_DIR = Path(__file__).resolve().parent.parent
+
+
+def use_service(name: str) -> None:
+    """
+    Make `services/<name>` importable the way its dockerfile runs it, with
+    dummy credentials so module-level clients can be constructed offline.
+    """
+    os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+    os.environ.setdefault("SUPABASE_KEY", "bench.bench.bench")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    os.environ.setdefault("JWT_SECRET", "bench-secret")
+    sys.path.insert(0, str(SERVICES_DIR / name))
+    os.chdir(SERVICES_DIR / name)
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux), or 0 when unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def latency_summary(samples_s: List[float]) -> Dict[str, float]:
+    if not samples_s:
+        return {}
+    ms = np.asarray(samples_s) * 1000.0
+    return {
+        "n": int(ms.size),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SERVICES_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
@@ -0,0 +1,336 @@
+"""
+In-process stand-ins for Supabase/PostgREST and OpenAI embeddings.
+
+Only the query-builder surface the services actually use is implemented.
+Every `execute()` counts as one round trip and can optionally sleep to
+simulate network latency; selects are capped at `max_rows` just like a
+PostgREST deployment with `db-max-rows` set (Supabase defaults to 1000).
+"""
+import hashlib
+import json
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from supabase import Client
+from postgrest import APIResponse
+from langchain_core.embeddings import Embeddings
+
+
+# -------------------- supabase --------------------
+
+def _split_columns(columns: str) -> List[str]:
+    """Split a PostgREST select string on top-level commas."""
+    out, depth, cur = [], 0, []
+    for ch in columns or "*":
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            out.append("".join(cur).strip())
+            cur = []
+        else:
+            cur.append(ch)
+    if "".join(cur).strip():
+        out.append("".join(cur).strip())
+    return out
+
+
+class _FakeQuery:
+    def __init__(self, db: "FakeSupabase", table: str):
+        self._db = db
+        self._table = table
+        self._op = "select"
+        self._columns = "*"
+        self._payload: Any = None
+        self._filters: List[tuple] = []
+        self._order: Optional[tuple] = None
+        self._limit: Optional[int] = None
+        self._offset = 0
+        self._count: Optional[str] = None
+
+    # ----- operations -----
+    def select(self, columns: str = "*", count: Optional[str] = None):
+        self._op, self._columns, self._count = "select", columns, count
+        return self
+
+    def insert(self, rows):
+        self._op, self._payload = "insert", rows
+        return self
+
+    def update(self, values: Dict[str, Any]):
+        self._op, self._payload = "update", values
+        return self
+
+    def delete(self):
+        self._op = "delete"
+        return self
+
+    # ----- filters / modifiers -----
+    def eq(self, column, value):
+        self._filters.append((column, lambda v, x=value: v == x))
+        return self
+
+    def neq(self, column, value):
+        self._filters.append((column, lambda v, x=value: v != x))
+        return self
+
+    def in_(self, column, values):
+        allowed = set(values)
+        self._filters.append((column, lambda v: v in allowed))
+        return self
+
+    def gt(self, column, value):
+        self._filters.append((column, lambda v, x=value: v is not None and v > x))
+        return self
+
+    def gte(self, column, value):
+        self._filters.append((column, lambda v, x=value: v is not None and v >= x))
+        return self
+
+    def lt(self, column, value):
+        self._filters.append((column, lambda v, x=value: v is not None and v < x))
+        return self
+
+    def lte(self, column, value):
+        self._filters.append((column, lambda v, x=value: v is not None and v <= x))
+        return self
+
+    def order(self, column, *, desc: bool = False):
+        self._order = (column, desc)
+        return self
+
+    def limit(self, size: int):
+        self._limit = int(size)
+        return self
+
+    def range(self, start: int, end: int):
+        self._offset, self._limit = int(start), int(end) - int(start) + 1
+        return self
+
+    # ----- execution -----
+    def _resolve(self, row: Dict[str, Any], path: str) -> Any:
+        """Resolve `col` or `embedded.col` (embedded via `<embedded>_id`)."""
+        if "." not in path:
+            return row.get(path)
+        embedded, col = path.split(".", 1)
+        target = self._db.get_row(embedded, row.get(f"{embedded}_id"))
+        return target.get(col) if target else None
+
+    def _project(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        cols = _split_columns(self._columns)
+        if cols == ["*"]:
+            return dict(row)
+        out = {}
+        for col in cols:
+            if "(" in col:
+                name = col.split("(", 1)[0].split("!", 1)[0].strip()
+                inner = col[col.index("(") + 1:col.rindex(")")]
+                target = self._db.get_row(name, row.get(f"{name}_id")) or {}
+                out[name] = {c: target.get(c) for c in _split_columns(inner)}
+            else:
+                out[col] = row.get(col)
+        return out
+
+    def _matching(self) -> List[Dict[str, Any]]:
+        rows = self._db.rows(self._table)
+        return [r for r in rows if all(pred(self._resolve(r, col)) for col, pred in self._filters)]
+
+    def execute(self) -> APIResponse:
+        self._db._round_trip(self._table, self._op)
+        count = None
+        with self._db._lock:
+            if self._op == "insert":
+                payload = self._payload if isinstance(self._payload, list) else [self._payload]
+                data = [self._db.insert_row(self._table, r) for r in payload]
+            elif self._op == "update":
+                data = self._matching()
+                for r in data:
+                    r.update(self._payload)
+                data = [dict(r) for r in data]
+            elif self._op == "delete":
+                data = self._matching()
+                self._db.delete_rows(self._table, data)
+            else:
+                data = self._matching()
+                if self._count:
+                    count = len(data)
+                if self._order is not None:
+                    col, desc = self._order
+                    data.sort(key=lambda r: r.get(col), reverse=desc)
+                limit = self._db.max_rows if self._limit is None else min(self._limit, self._db.max_rows or self._limit)
+                data = data[self._offset:]
+                if limit:
+                    data = data[:limit]
+                data = [self._project(r) for r in data]
+        return APIResponse(data=data, count=count)
+
+
+class FakeSupabase(Client):
+    """
+    Dict-backed table store that quacks like `supabase.Client`.
+
+    Subclasses `Client` only so pydantic's isinstance checks on
+    `SupabaseRetriever.supabase` pass; none of the HTTP machinery is set up.
+    """
+
+    def __init__(self, *, latency_s: float = 0.0, max_rows: Optional[int] = 1000):
+        self.latency_s = latency_s
+        self.max_rows = max_rows
+        self.round_trips: Dict[str, int] = {}
+        self._tables: Dict[str, Dict[Any, Dict[str, Any]]] = {}
+        self._next_id: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    def table(self, table_name: str) -> _FakeQuery:
+        return _FakeQuery(self, table_name)
+
+    def from_(self, table_name: str) -> _FakeQuery:
+        return self.table(table_name)
+
+    # ----- storage -----
+    def rows(self, table: str) -> List[Dict[str, Any]]:
+        return list(self._tables.get(table, {}).values())
+
+    def get_row(self, table: str, row_id: Any) -> Optional[Dict[str, Any]]:
+        return self._tables.get(table, {}).get(row_id)
+
+    def insert_row(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        row = dict(row)
+        if "id" not in row:
+            if table == "chunks":
+                # bigserial-like ids keep keyset pagination meaningful
+                self._next_id[table] = self._next_id.get(table, 0) + 1
+                row["id"] = self._next_id[table]
+            else:
+                row["id"] = str(uuid.uuid4())
+        if table == "embeddings" and isinstance(row.get("embedding"), list):
+            # pgvector comes back from PostgREST as its text form
+            row["embedding"] = json.dumps(row["embedding"])
+        self._tables.setdefault(table, {})[row["id"]] = row
+        return dict(row)
+
+    def delete_rows(self, table: str, rows: Iterable[Dict[str, Any]]) -> None:
+        t = self._tables.get(table, {})
+        for r in rows:
+            t.pop(r["id"], None)
+
+    def _round_trip(self, table: str, op: str) -> None:
+        with self._lock:
+            key = f"{table}.{op}"
+            self.round_trips[key] = self.round_trips.get(key, 0) + 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+
+    def total_round_trips(self) -> int:
+        return sum(self.round_trips.values())
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.round_trips.clear()
+
+
+# -------------------- embeddings --------------------
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic unit vectors seeded from a hash of the text.
+
+    `latency_s` is charged once per call (not per text) to mimic one HTTP
+    request to the embeddings API.
+    """
+
+    def __init__(self, dim: int = 1536, latency_s: float = 0.0):
+        self.dim = dim
+        self.latency_s = latency_s
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _vec(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.blake2b((text or "").encode("utf-8"), digest_size=8).digest(), "little")
+        v = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        v /= (np.linalg.norm(v) or 1.0)
+        return v.tolist()
+
+    def _charge(self) -> None:
+        with self._lock:
+            self.calls += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._charge()
+        return [self._vec(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self._charge()
+        return self._vec(text)
+
+
+# -------------------- synthetic data --------------------
+
+VOCAB_SIZE = 5000
+
+
+def make_vocab(seed: int = 0) -> List[str]:
+    rng = np.random.default_rng(seed)
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    lengths = rng.integers(3, 10, size=VOCAB_SIZE)
+    return ["".join(rng.choice(letters, size=n)) for n in lengths]
+
+
+def synthetic_text(rng: np.random.Generator, vocab: List[str], n_chars: int) -> str:
+    # Zipf-ish word frequencies so lexical prefiltering behaves like real text
+    words = []
+    size = 0
+    while size < n_chars:
+        w = vocab[min(int(rng.zipf(1.3)) - 1, len(vocab) - 1)]
+        words.append(w)
+        size += len(w) + 1
+    return " ".join(words)
+
+
+def seed_project(
+    db: FakeSupabase,
+    *,
+    n_chunks: int,
+    dim: int = 1536,
+    chunks_per_file: int = 200,
+    chunk_chars: int = 1500,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Populate project/files/chunks/embeddings tables with one synthetic project."""
+    rng = np.random.default_rng(seed)
+    vocab = make_vocab(seed)
+    owner_id = "bench-owner"
+    project = db.insert_row("project", {
+        "id": str(uuid.UUID(int=seed)),
+        "owner_id": owner_id,
+        "tone": "neutral",
+        "complexity": "intermediate",
+        "authority": "default",
+        "detail": "default",
+    })
+    n_files = max(1, -(-n_chunks // chunks_per_file))
+    made = 0
+    for f in range(n_files):
+        file_row = db.insert_row("files", {
+            "project_id": project["id"],
+            "name": f"lecture-{f:04d}.pdf",
+            "status": "completed",
+            "updated_at": f"2025-01-01T00:00:{f % 60:02d}+00:00",
+        })
+        for ci in range(min(chunks_per_file, n_chunks - made)):
+            chunk = db.insert_row("chunks", {
+                "file_id": file_row["id"],
+                "content": synthetic_text(rng, vocab, chunk_chars),
+                "chunk_index": ci,
+            })
+            v = rng.standard_normal(dim).astype(np.float32)
+            v /= (np.linalg.norm(v) or 1.0)
+            db.insert_row("embeddings", {"chunk_id": chunk["id"], "embedding": v.tolist()})
+            made += 1
+    return {"project_id": project["id"], "owner_id": owner_id, "files": n_files, "chunks": made, "vocab": vocab}
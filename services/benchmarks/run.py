@@ -0,0 +1,120 @@
+"""
+Offline benchmark suite for the chat and chunk-embed hot paths.
+
+    python benchmarks/run.py --out bench.json
+    python benchmarks/run.py --sizes 1000,10000,100000,500000 --out full.json
+    python benchmarks/run.py --compare before.json --out after.json
+
+Each scenario runs in its own interpreter so peak RSS is per scenario and
+the two services (which both ship a top-level `main`/`utils`) never share
+a process. Nothing touches the network except tiktoken's one-time download
+of `cl100k_base` for the `embed_file` case; set TIKTOKEN_CACHE_DIR to a
+warm cache to run fully offline.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+from common import git_revision
+
+HERE = Path(__file__).resolve().parent
+
+DEFAULT_SIZES = "1000,10000,50000"
+
+# (path into a result, lower-is-better) for --compare
+TRACKED = [
+    ("load_data_s", True),
+    ("query.p50_ms", True),
+    ("query.p99_ms", True),
+    ("peak_rss_bytes", True),
+    ("save_chunks_and_embeddings.chunks_per_s", False),
+    ("embed_file.chunks_per_s", False),
+]
+
+
+def _run(script: str, extra: list) -> dict:
+    out = subprocess.run(
+        [sys.executable, str(HERE / script), *extra],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def _get(d: dict, path: str):
+    for part in path.split("."):
+        if not isinstance(d, dict) or part not in d:
+            return None
+        d = d[part]
+    return d
+
+
+def _scenario_key(r: dict) -> str:
+    p = r.get("params", {})
+    return f"{r['bench']}:{p.get('chunks')}"
+
+
+def compare(before: dict, after: dict) -> None:
+    prev = {_scenario_key(r): r for r in before.get("results", [])}
+    for r in after.get("results", []):
+        old = prev.get(_scenario_key(r))
+        if not old:
+            continue
+        for path, lower_better in TRACKED:
+            a, b = _get(old, path), _get(r, path)
+            if not isinstance(a, (int, float)) or not isinstance(b, (int, float)) or not a:
+                continue
+            change = (b - a) / a * 100.0
+            worse = change > 0 if lower_better else change < 0
+            flag = "  REGRESSION" if worse and abs(change) >= 10 else ""
+            print(f"{_scenario_key(r):>20} {path:<42} {a:>14.3f} -> {b:>14.3f} ({change:+.1f}%){flag}",
+                  file=sys.stderr)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated project sizes in chunks")
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--ingest-chunks", type=int, default=2000)
+    ap.add_argument("--uploads", type=int, default=5)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--embed-latency-ms", type=float, default=0.0)
+    ap.add_argument("--max-rows", type=int, default=1000)
+    ap.add_argument("--out", help="write JSON here instead of stdout")
+    ap.add_argument("--compare", help="previous JSON to diff against (printed to stderr)")
+    args = ap.parse_args()
+
+    common = ["--dim", str(args.dim), "--latency-ms", str(args.latency_ms),
+              "--embed-latency-ms", str(args.embed_latency_ms), "--max-rows", str(args.max_rows)]
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        results.append(_run("bench_retrieval.py", ["--chunks", str(size), "--queries", str(args.queries), *common]))
+        print(f"retrieval {size}: done", file=sys.stderr)
+    results.append(_run("bench_ingestion.py", ["--chunks", str(args.ingest_chunks), "--uploads", str(args.uploads), *common]))
+    print("ingestion: done", file=sys.stderr)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text()), report)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
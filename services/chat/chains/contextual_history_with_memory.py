@@ -1,13 +1,23 @@
+import re
 import json
-from typing import Any, Dict, List
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+import numpy as np
 from pydantic import BaseModel, Field
 
 from langchain.tools import StructuredTool
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.agents import create_tool_calling_agent, AgentExecutor
 from langchain.tools.render import render_text_description
 
+from utils.metrics import span, record
+from utils.packing import get_encoder, pack_snippets
+from utils.clients import get_chat_model
+
 import logging
 logger = logging.getLogger("virtual_ta")
 if not logger.handlers:
@@ -56,6 +66,31 @@ Tool contract (internal):
 - Use it to pull accurate course-specific facts, then answer normally. Only include (Title, p. X) if the student asks for sources.
 """
 
+HINT = "\n\n(If course-specific or unsure, call `retrieve_course_materials` before answering.)"
+
+# "agent": the model decides whether/what to retrieve (tool call round trip)
+# "speculative": as "agent", but retrieval for the raw question starts while
+#     the first model call is in flight and serves the tool call if it matches
+# "retrieve_first": retrieve for the raw question and answer in one model call
+RETRIEVAL_MODES = ("agent", "speculative", "retrieve_first")
+
+# Token-set Jaccard at which a tool query counts as the raw question without
+# embedding it
+LEXICAL_MATCH = 0.8
+
+_prefetch_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="prefetch")
+
+
+def _tokens(text: str) -> set:
+    return set(re.findall(r"[a-z0-9]+", (text or "").lower()))
+
+
+def _cosine(a, b) -> float:
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    denom = float(np.linalg.norm(a) * np.linalg.norm(b))
+    return float(a @ b) / denom if denom else 0.0
+
 
 def build_virtual_ta_agent(
     retriever,
@@ -64,32 +99,83 @@ def build_virtual_ta_agent(
     model: str = "gpt-4o-mini",
     temperature: float = 0.3,
     k_default: int = 4,
-    snippet_char_limit: int = 1200,
+    k_max: int = 40,
+    token_budget: int = 3000,
+    snippet_token_limit: Optional[int] = None,
     sys_style: str = "",
+    retrieval_mode: str = "agent",
+    prefetch_similarity: float = 0.85,
 ):
+    if retrieval_mode not in RETRIEVAL_MODES:
+        raise ValueError(f"retrieval_mode must be one of {RETRIEVAL_MODES}, got {retrieval_mode!r}")
+
+    encoder = get_encoder(model)
+    embeddings_model = getattr(retriever, "embeddings_model", None)
+
+    # Speculative retrieval for the turn in flight. build_virtual_ta_agent is
+    # called per request, so this state is never shared between requests.
+    prefetch: Dict[str, Any] = {}
+
     class RetrieveArgs(BaseModel):
         query: str = Field(...,
                            description="Student's question or focused lookup")
         k: int = Field(
             k_default, description="How many snippets to fetch (top-k)")
 
+    def _prefetch(question: str):
+        with span("prefetch"):
+            q_vec = embeddings_model.embed_query(question) if embeddings_model is not None else None
+            kwargs = {"query_vector": q_vec} if q_vec is not None else {}
+            return q_vec, retriever.invoke(question, k=k_default, **kwargs)
+
+    def _from_prefetch(query: str, k: int):
+        """
+        (docs, None) if the prefetch for the raw question can serve this tool
+        call, else (None, vector of `query` if one had to be computed).
+        """
+        future = prefetch.get("future")
+        if future is None or k > k_default:
+            return None, None
+        try:
+            with span("prefetch_wait"):
+                q_vec, docs = future.result()
+        except Exception as e:
+            logger.warning(f"Speculative retrieval failed: {e}")
+            return None, None
+
+        a, b = _tokens(query), _tokens(prefetch["question"])
+        if a and b and len(a & b) / len(a | b) >= LEXICAL_MATCH:
+            return docs[:k], None
+        if q_vec is None:
+            return None, None
+        with span("embed_query"):
+            t_vec = embeddings_model.embed_query(query)
+        if _cosine(t_vec, q_vec) >= prefetch_similarity:
+            return docs[:k], None
+        return None, t_vec
+
     def retrieve_course_materials_impl(query: str, k: int = k_default) -> str:
         logger.info(">>> retrieve_course_materials_impl CALLED")
         logger.info(f"[Retriever Query] {query}")
 
-        docs = retriever.get_relevant_documents(query)[:k]
-        snippets: List[Dict[str, Any]] = []
-        for d in docs:
-            meta = getattr(d, "metadata", {}) or {}
-            text = (getattr(d, "page_content", "") or "")[:snippet_char_limit]
-            snippet = {
-                "text": text,
-                "title": meta.get("title") or meta.get("source") or "Course material",
-                "page": meta.get("page"),
-                "id": meta.get("doc_id") or meta.get("source"),
-            }
-            snippets.append(snippet)
-            print(f"[Retrieved Snippet] {json.dumps(snippet, indent=2)}")
+        k = max(1, min(int(k or k_default), k_max))
+        docs, t_vec = _from_prefetch(query, k)
+        if docs is not None:
+            logger.info("[Retriever] served from speculative prefetch")
+        else:
+            kwargs = {"query_vector": t_vec} if t_vec is not None else {}
+            with span("retrieve"):
+                docs = retriever.invoke(query, k=k, **kwargs)
+        with span("pack"):
+            snippets = pack_snippets(
+                docs,
+                encoder=encoder,
+                token_budget=token_budget,
+                snippet_token_limit=snippet_token_limit,
+            )
+        if logger.isEnabledFor(logging.DEBUG):
+            for snippet in snippets:
+                logger.debug(f"[Retrieved Snippet] {json.dumps(snippet)}")
         return json.dumps({"snippets": snippets})
 
     retrieve_tool = StructuredTool.from_function(
@@ -103,33 +189,43 @@ def build_virtual_ta_agent(
     # Prompt
     system_block = (sys_style.strip() +
                     "\n\n" if sys_style else "") + SYSTEM.strip()
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_block +
-         "\n\nYou can use these tools if needed:\n{tools}"),
-        MessagesPlaceholder("history"),
-        ("human", "{input}"),
-        MessagesPlaceholder("agent_scratchpad"),
-    ]).partial(tools=render_text_description([retrieve_tool]))
-
-    llm = ChatOpenAI(model=model, temperature=temperature)
-
-    agent = create_tool_calling_agent(llm, [retrieve_tool], prompt)
-    executor = AgentExecutor(
-        agent=agent,
-        tools=[retrieve_tool],
-        verbose=False,
-        max_iterations=3,
-        handle_parsing_errors=True,
-    )
-
-    async def stream(question: str, session_id: str):
-        history = session_store.get(session_id)
 
-        hinted = question + \
-            "\n\n(If course-specific or unsure, call `retrieve_course_materials` before answering.)"
-
-        # Buffer to save the final assistant message to history later
-        buf = []
+    llm = get_chat_model(model, temperature)
+
+    # Only the path this mode uses is built: this runs on every request
+    answer_chain = executor = None
+    if retrieval_mode == "retrieve_first":
+        # Single-call path: snippets go straight into the prompt
+        answer_chain = ChatPromptTemplate.from_messages([
+            ("system", system_block +
+             "\n\nCourse material retrieved for this question "
+             "(output of `retrieve_course_materials`):\n{snippets}"),
+            MessagesPlaceholder("history"),
+            ("human", "{input}"),
+        ]) | llm
+    else:
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", system_block +
+             "\n\nYou can use these tools if needed:\n{tools}"),
+            MessagesPlaceholder("history"),
+            ("human", "{input}"),
+            MessagesPlaceholder("agent_scratchpad"),
+        ]).partial(tools=render_text_description([retrieve_tool]))
+
+        agent = create_tool_calling_agent(llm, [retrieve_tool], prompt)
+        executor = AgentExecutor(
+            agent=agent,
+            tools=[retrieve_tool],
+            verbose=False,
+            max_iterations=3,
+            handle_parsing_errors=True,
+        )
+
+    async def _agent_tokens(question: str, history):
+        hinted = question + HINT
+
+        # run_id -> start time for LLM calls and tool round trips
+        started: Dict[str, float] = {}
 
         async for event in executor.astream_events(
             {"input": hinted, "history": history.messages},
@@ -137,14 +233,57 @@ def build_virtual_ta_agent(
         ):
             et = event["event"]
 
+            if et in ("on_chat_model_start", "on_tool_start"):
+                started[event["run_id"]] = time.perf_counter()
+            elif et in ("on_chat_model_end", "on_tool_end"):
+                t = started.pop(event["run_id"], None)
+                if t is not None:
+                    record("llm_call" if et == "on_chat_model_end" else "tool", time.perf_counter() - t)
+
             # Stream only LLM token chunks to the client
             if et == "on_chat_model_stream":
                 chunk = event["data"]["chunk"]
                 text = chunk.content
                 if text:
-                    buf.append(text)
                     yield text
 
+    async def _retrieve_first_tokens(question: str, history):
+        snippets = await asyncio.to_thread(retrieve_course_materials_impl, question, k_default)
+        t = time.perf_counter()
+        async for chunk in answer_chain.astream(
+            {"input": question, "history": history.messages, "snippets": snippets}
+        ):
+            if chunk.content:
+                yield chunk.content
+        record("llm_call", time.perf_counter() - t)
+
+    async def stream(question: str, session_id: str):
+        history = session_store.get(session_id)
+
+        # Buffer to save the final assistant message to history later
+        buf = []
+        t0 = time.perf_counter()
+
+        if retrieval_mode == "speculative":
+            prefetch["question"] = question
+            prefetch["future"] = _prefetch_pool.submit(contextvars.copy_context().run, _prefetch, question)
+
+        if retrieval_mode == "retrieve_first":
+            tokens = _retrieve_first_tokens(question, history)
+        else:
+            tokens = _agent_tokens(question, history)
+
+        try:
+            async for text in tokens:
+                if not buf:
+                    record("first_token", time.perf_counter() - t0)
+                buf.append(text)
+                yield text
+        finally:
+            prefetch.clear()
+
+        record("agent_stream", time.perf_counter() - t0)
+
         # Persist conversation after the full output is known
         final_text = "".join(buf)
         history.add_user_message(question)
@@ -153,13 +292,18 @@ def build_virtual_ta_agent(
     def run(question: str, session_id: str) -> str:
         history = session_store.get(session_id)
 
-        # Optional: tiny hint that increases tool usage without forcing
-        hinted = question + \
-            "\n\n(If course-specific or unsure, call `retrieve_course_materials` before answering.)"
-
-        result = executor.invoke(
-            {"input": hinted, "history": history.messages})
-        text = result.get("output", "")
+        if retrieval_mode == "retrieve_first":
+            snippets = retrieve_course_materials_impl(question, k_default)
+            result = answer_chain.invoke(
+                {"input": question, "history": history.messages, "snippets": snippets})
+            text = result.content
+        else:
+            # Optional: tiny hint that increases tool usage without forcing
+            hinted = question + HINT
+
+            result = executor.invoke(
+                {"input": hinted, "history": history.messages})
+            text = result.get("output", "")
 
         history.add_user_message(question)
         history.add_ai_message(text)
@@ -1,4 +1,7 @@
 import os
+import re
+import time
+import hashlib
 from uuid import uuid4
 from typing import Optional
 from dotenv import load_dotenv
@@ -9,14 +12,19 @@ import sentry_sdk
 from sentry_sdk.crons import monitor
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse
-from supabase import Client, create_client
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from supabase import Client
 
-from langchain_openai import ChatOpenAI
-
-from retrievers.SupabaseRetriever import build_supabase_retriever
-from chains.contextual_history_with_memory import build_virtual_ta_agent
+from retrievers.SupabaseRetriever import build_supabase_retriever, fetch_content_version
+from retrievers.ProjectIndexCache import ProjectIndexCache
+from chains.contextual_history_with_memory import RETRIEVAL_MODES, build_virtual_ta_agent
 from utils.SessionStore import SessionStore
+from utils.AnswerCache import AnswerCache
+from utils.AdmissionControl import AdmissionControl, Overloaded, Ticket
+from utils import metrics
+from utils.clients import create_supabase_client, get_chat_model
+from utils.embeddings import embedding_space, get_embedder
 
 load_dotenv()
 
@@ -24,8 +32,26 @@ APP_ENV = os.getenv("APP_ENV")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
+INDEX_SNAPSHOT_DIR = os.getenv("INDEX_SNAPSHOT_DIR") or None
+INDEX_REFRESH_SEC = float(os.getenv("INDEX_REFRESH_SEC", "30"))
+INDEX_CACHE_MAX_PROJECTS = int(os.getenv("INDEX_CACHE_MAX_PROJECTS", "16"))
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "").lower() in ("1", "true", "yes", "on")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SEC = int(os.getenv("ANSWER_CACHE_TTL_SEC", str(24 * 60 * 60)))
+# "agent" | "speculative" | "retrieve_first", see build_virtual_ta_agent
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "agent")
+if RETRIEVAL_MODE not in RETRIEVAL_MODES:
+    # Fail at startup rather than on every chat request
+    raise ValueError(f"RETRIEVAL_MODE must be one of {RETRIEVAL_MODES}, got {RETRIEVAL_MODE!r}")
+PREFETCH_SIMILARITY = float(os.getenv("PREFETCH_SIMILARITY", "0.85"))
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "64"))
+ADMISSION_MAX_PER_PROJECT = int(os.getenv("ADMISSION_MAX_PER_PROJECT", "16"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+ADMISSION_MAX_QUEUE_PER_PROJECT = int(os.getenv("ADMISSION_MAX_QUEUE_PER_PROJECT", "64"))
+ADMISSION_QUEUE_TIMEOUT_SEC = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SEC", "10"))
+
 app = FastAPI()
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase: Client = create_supabase_client(SUPABASE_URL, SUPABASE_KEY)
 
 if APP_ENV == "production":
     SENTRY_DSN = os.getenv("SENTRY_DSN")
@@ -64,13 +90,51 @@ if APP_ENV == "production":
             except Exception:
                 pass
 
+# Bounds in-flight chat turns (held for the whole SSE stream), fair across projects
+admission = AdmissionControl(
+    max_concurrent=ADMISSION_MAX_CONCURRENT,
+    max_per_project=ADMISSION_MAX_PER_PROJECT,
+    max_queue=ADMISSION_MAX_QUEUE,
+    max_queue_per_project=ADMISSION_MAX_QUEUE_PER_PROJECT,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT_SEC,
+)
+
+if metrics.METRICS_ENABLED:
+    metrics.register(metrics.Gauge(
+        "squawk_chat_admission", "Chat turns running/queued in this worker", "state",
+        lambda: {k: v for k, v in admission.stats().items() if not k.endswith("_total")}))
+    metrics.register(metrics.Gauge(
+        "squawk_chat_admission_total", "Chat turns admitted/shed by this worker", "outcome",
+        lambda: {k[:-len("_total")]: v for k, v in admission.stats().items() if k.endswith("_total")},
+        kind="counter"))
+
+    @app.get("/metrics")
+    async def metrics_endpoint():
+        return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4")
+
 # Optional; not required by the agent builder below
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+llm = get_chat_model("gpt-4o-mini", 0)
 
 # IMPORTANT: SessionStore must be LangChain-compatible (has .get(session_id) -> history with
 # .messages (BaseMessage[]), .add_user_message(), .add_ai_message()).
 session_store = SessionStore(max_messages=50)
 
+# Loaded project indexes, delta-synced instead of reloaded per request
+index_cache = ProjectIndexCache(
+    build=lambda project_id, content_version, space: build_supabase_retriever(
+        supabase,
+        project_id,
+        snapshot_dir=INDEX_SNAPSHOT_DIR,
+        content_version=content_version,
+        embedding_space=space,
+    ),
+    refresh_interval=INDEX_REFRESH_SEC,
+    max_projects=INDEX_CACHE_MAX_PROJECTS,
+)
+
+# Opt-in: first-turn answers reused across students of the same project
+answer_cache = AnswerCache(threshold=ANSWER_CACHE_THRESHOLD, ttl_seconds=ANSWER_CACHE_TTL_SEC)
+
 TONE_RULES = {
     "formal": "Use precise, professional, and structured language. Avoid contractions and colloquialisms.",
     "neutral": "Use clear, plain language. Stay objective and free of emotional or casual phrasing.",
@@ -108,9 +172,20 @@ def _sse_event_from_text(text: str) -> str:
     return "".join(out)
 
 
+async def _replay_answer(answer: str, question: str, session_id: str):
+    """Stream a cached answer like agent_stream does, a few words per chunk."""
+    history = session_store.get(session_id)
+    words = re.findall(r"\s*\S+", answer)
+    for i in range(0, len(words), 8):
+        yield "".join(words[i:i + 8])
+
+    history.add_user_message(question)
+    history.add_ai_message(answer)
+
+
 @app.get("/status")
 async def status_check():
-    return {"status": "ok", "message": "Chat service is live"}
+    return {"status": "ok", "message": "Chat service is live", "admission": admission.stats()}
 
 
 @app.post("/")
@@ -124,12 +199,34 @@ async def conversation(request: Request, conversation_request: Conversation):
         raise HTTPException(
             status_code=400, detail="project_id and query are required")
 
-    project = (
-        supabase.table("project")
-        .select("id, tone, complexity, authority, detail")
-        .eq("id", str(project_id))
-        .execute()
-    )
+    timings = metrics.begin_request()
+    t_request = time.perf_counter()
+
+    try:
+        ticket = await admission.acquire(str(project_id))
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason,
+                            headers={"Retry-After": str(e.retry_after)})
+    metrics.record("admission_wait", ticket.waited)
+
+    try:
+        return await _open_stream(ticket, project_id, query, conversation_id, timings, t_request)
+    except BaseException:
+        ticket.release()
+        raise
+
+
+async def _open_stream(ticket: Ticket, project_id: str, query: str, conversation_id: str, timings, t_request: float):
+    """Everything after admission; `ticket` is released when the stream ends."""
+    # Supabase calls and index builds block; keep them off the event loop so
+    # queued requests keep being admitted and shed meanwhile
+    with metrics.span("project_config"):
+        project = await asyncio.to_thread(
+            supabase.table("project")
+            .select("*")  # embedding_backend is optional
+            .eq("id", str(project_id))
+            .execute
+        )
     if not project.data:
         raise HTTPException(status_code=404, detail="project not found")
 
@@ -137,6 +234,7 @@ async def conversation(request: Request, conversation_request: Conversation):
     complexity = project.data[0].get("complexity")
     authority = project.data[0].get("authority")
     detail = project.data[0].get("detail")
+    space = embedding_space(project.data[0].get("embedding_backend"))
 
     if tone not in TONE_RULES:
         tone = "neutral"
@@ -155,34 +253,74 @@ async def conversation(request: Request, conversation_request: Conversation):
         f"- Authority: {AUTHORITY_RULES[authority]}",
     ])
 
-    supabase_retriever = build_supabase_retriever(supabase, project_id)
-
-    agent_run, agent_stream = build_virtual_ta_agent(
-        retriever=supabase_retriever,
-        session_store=session_store,
-        model="gpt-4o-mini",
-        temperature=0.3,
-        k_default=20,
-        snippet_char_limit=1200,
-        sys_style=sys_prompt,
-    )
+    # Only first turns are cacheable; later turns depend on the conversation
+    cache_entry = None
+    cached_answer = None
+    content_version = None
+    if ANSWER_CACHE_ENABLED and not session_store.get(conversation_id).messages:
+        with metrics.span("answer_cache"):
+            content_version = await asyncio.to_thread(fetch_content_version, supabase, project_id, space)
+            version = hashlib.sha1((sys_prompt + content_version).encode("utf-8")).hexdigest()
+            # The project's own embedder: no API round trip for local-backend projects
+            q_vec = await asyncio.to_thread(get_embedder(space).embed_query, query.strip().lower())
+            cached_answer = answer_cache.lookup(project_id, version, q_vec)
+        cache_entry = (project_id, version, q_vec)
+
+    if cached_answer is not None:
+        cache_entry = None
+        answer_stream = _replay_answer(cached_answer, query, conversation_id)
+    else:
+        with metrics.span("project_load"):
+            supabase_retriever = await asyncio.to_thread(index_cache.get, project_id, content_version, space)
+
+        agent_run, agent_stream = build_virtual_ta_agent(
+            retriever=supabase_retriever,
+            session_store=session_store,
+            model="gpt-4o-mini",
+            temperature=0.3,
+            k_default=20,
+            token_budget=3000,
+            sys_style=sys_prompt,
+            retrieval_mode=RETRIEVAL_MODE,
+            prefetch_similarity=PREFETCH_SIMILARITY,
+        )
+        answer_stream = agent_stream(query, conversation_id)
+
+    # Stages after this point finish mid-stream, so they are reported in a
+    # trailing SSE comment (ignored by clients) rather than the header.
+    server_timing = metrics.server_timing(timings)
 
     async def sse_generator():
+        metrics.bind(timings)
+        answer = []
         try:
             # Stream token chunks as SSE lines
-            async for chunk in agent_stream(query, conversation_id):
+            async for chunk in answer_stream:
                 # You can batch or throttle if you want; simplest is line-per-chunk:
+                answer.append(chunk)
                 yield _sse_event_from_text(chunk)
                 await asyncio.sleep(0)
 
+            if cache_entry is not None:
+                answer_cache.store(*cache_entry, "".join(answer))
+
+            if metrics.METRICS_ENABLED:
+                metrics.record("total", time.perf_counter() - t_request)
+                yield f": server-timing {metrics.server_timing(timings)}\n\n"
             yield "data: [done]\n\n"
         except asyncio.CancelledError:
             return
         except Exception as e:
             yield f"event: error\ndata: {str(e)}\n\n"
+        finally:
+            ticket.release()
 
-    resp = StreamingResponse(sse_generator(), media_type="text/event-stream")
+    # The background task covers a stream that never starts (client gone first)
+    resp = StreamingResponse(sse_generator(), media_type="text/event-stream",
+                             background=BackgroundTask(ticket.release))
     resp.headers["Cache-Control"] = "no-cache"
     resp.headers["Connection"] = "keep-alive"
     resp.headers["X-Accel-Buffering"] = "no"
+    if server_timing:
+        resp.headers["Server-Timing"] = server_timing
     return resp
\ No newline at end of file
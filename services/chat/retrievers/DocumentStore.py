@@ -0,0 +1,238 @@
+import mmap
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+# bytes, or a read-only mmap.mmap of a snapshot's lowered.bin; both have find()
+LoweredText = Union[bytes, mmap.mmap]
+
+# Bytes lowercased per step when building the lowered column from `text`
+LOWER_BLOCK = 1 << 20
+
+
+def id_column(ids: Sequence[Any]) -> np.ndarray:
+    # bigserial ids pack into int64; anything else (uuids) stays as objects
+    if all(type(x) is int for x in ids):
+        try:
+            return np.asarray(ids, dtype=np.int64)
+        except OverflowError:
+            pass
+    col = np.empty(len(ids), dtype=object)
+    col[:] = list(ids)
+    return col
+
+
+class DocumentStore:
+    """
+    Column-oriented store for a project's chunks.
+
+    Texts live back to back in one utf-8 buffer (`offsets[i]:offsets[i + 1]`),
+    and chunk_id, file code and chunk_index are arrays; `files[code]` is
+    (file_id, file_name). A project costs a handful of objects instead of a
+    `Document` plus metadata dict per chunk, and the buffers can be
+    memory-mapped straight from a snapshot. `Document`s are only built for
+    the chunks a query returns (`documents()`).
+
+    ASCII stores also carry `lowered`, the text buffer lowercased, which the
+    keyword prefilter scans. It is built with the store and kept in
+    snapshots, so a memory-mapped store shares it like `text` rather than
+    each worker lowercasing a private copy.
+    """
+
+    __slots__ = ("text", "offsets", "chunk_ids", "file_code", "chunk_index", "files", "lowered", "ascii")
+
+    def __init__(
+        self,
+        text: np.ndarray,
+        offsets: np.ndarray,
+        chunk_ids: np.ndarray,
+        file_code: np.ndarray,
+        chunk_index: np.ndarray,
+        files: List[tuple],
+        lowered: Optional[LoweredText] = None,
+        ascii: Optional[bool] = None,
+    ):
+        self.text = text                  # uint8, may be a read-only memmap
+        self.offsets = offsets            # int64 [n + 1]
+        self.chunk_ids = chunk_ids        # int64 (or object) [n]
+        self.file_code = file_code        # int32 [n], index into files
+        self.chunk_index = chunk_index    # int32 [n], -1 when missing
+        self.files = files                # [(file_id, file_name)]
+        self.lowered = lowered            # lowercased text (ASCII stores), or None
+        self.ascii = ascii                # text is ASCII; None until known
+
+    # -------------------- construction --------------------
+
+    @classmethod
+    def empty(cls) -> "DocumentStore":
+        return cls(np.empty(0, np.uint8), np.zeros(1, np.int64), np.empty(0, np.int64),
+                   np.empty(0, np.int32), np.empty(0, np.int32), [])
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict[str, Any]], file_names: Dict[Any, Optional[str]]) -> "DocumentStore":
+        """Pack chunk rows (id, content, file_id, chunk_index) in order."""
+        buf = bytearray()
+        offsets = [0]
+        ids, codes, chunk_index = [], [], []
+        code_of: Dict[Any, int] = {}
+        files: List[tuple] = []
+        for row in rows:
+            fid = row["file_id"]
+            code = code_of.get(fid)
+            if code is None:
+                code = code_of[fid] = len(files)
+                files.append((fid, file_names.get(fid)))
+            buf += (row["content"] or "").encode("utf-8")
+            offsets.append(len(buf))
+            ids.append(row["id"])
+            codes.append(code)
+            ci = row.get("chunk_index")
+            chunk_index.append(-1 if ci is None else int(ci))
+        text = bytes(buf)
+        ascii = text.isascii()
+        return cls(
+            np.frombuffer(text, dtype=np.uint8),
+            np.asarray(offsets, dtype=np.int64),
+            id_column(ids),
+            np.asarray(codes, dtype=np.int32),
+            np.asarray(chunk_index, dtype=np.int32),
+            files,
+            text.lower() if ascii else None,
+            ascii,
+        )
+
+    def select(self, idxs: Sequence[int]) -> "DocumentStore":
+        """A new store holding rows `idxs` (ascending)."""
+        idxs = np.asarray(idxs, dtype=np.int64)
+        starts, ends = self.offsets[idxs], self.offsets[idxs + 1]
+        offsets = np.zeros(len(idxs) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=offsets[1:])
+        # Copy the kept rows' bytes run by run (a file's rows are contiguous,
+        # so dropping files leaves few runs); memory follows the output size
+        runs = []
+        if len(idxs):
+            breaks = np.flatnonzero(idxs[1:] != idxs[:-1] + 1) + 1
+            runs = list(zip(starts[np.r_[0, breaks]].tolist(), ends[np.r_[breaks - 1, len(idxs) - 1]].tolist()))
+        text = np.concatenate([self.text[a:b] for a, b in runs] or [np.empty(0, np.uint8)])
+        lowered = b"".join(self.lowered[a:b] for a, b in runs) if self.lowered is not None else None
+        return DocumentStore(text.astype(np.uint8, copy=False), offsets, self.chunk_ids[idxs],
+                             self.file_code[idxs], self.chunk_index[idxs], list(self.files),
+                             lowered, True if self.ascii else None)
+
+    def concat(self, other: "DocumentStore") -> "DocumentStore":
+        files = list(self.files)
+        code_of = {fid: i for i, (fid, _) in enumerate(files)}
+        remap = np.empty(len(other.files), dtype=np.int32)
+        for j, (fid, name) in enumerate(other.files):
+            if fid not in code_of:
+                code_of[fid] = len(files)
+                files.append((fid, name))
+            remap[j] = code_of[fid]
+        lowered = None
+        if self.lowered is not None and other.lowered is not None:
+            lowered = b"".join([self.lowered, other.lowered])
+        ascii = False if False in (self.ascii, other.ascii) else (self.ascii and other.ascii)
+        return DocumentStore(
+            np.concatenate([self.text, other.text]).astype(np.uint8, copy=False),
+            np.concatenate([self.offsets, other.offsets[1:] + self.offsets[-1]]),
+            np.concatenate([self.chunk_ids, other.chunk_ids]),
+            np.concatenate([self.file_code, remap[other.file_code] if len(other) else other.file_code]),
+            np.concatenate([self.chunk_index, other.chunk_index]),
+            files,
+            lowered,
+            ascii,
+        )
+
+    # -------------------- access --------------------
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def is_ascii(self) -> bool:
+        if self.ascii is None:
+            # A reduction over the (possibly mapped) buffer: no copy of it
+            self.ascii = not len(self.text) or int(np.max(self.text)) < 0x80
+        return self.ascii
+
+    def lowered_text(self) -> LoweredText:
+        """`lowered`, built from `text` if this store was made without it (ASCII only)."""
+        if self.lowered is None:
+            self.lowered = b"".join(
+                bytes(self.text[i:i + LOWER_BLOCK]).lower() for i in range(0, len(self.text), LOWER_BLOCK))
+        return self.lowered
+
+    def page_content(self, i: int) -> str:
+        return bytes(self.text[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def value(self, i: int, key: str) -> Any:
+        """Metadata value `key` of row i, as `Document.metadata[key]` would hold it."""
+        if key == "file_id":
+            return self.files[self.file_code[i]][0]
+        if key == "chunk_index":
+            ci = int(self.chunk_index[i])
+            return ci if ci >= 0 else None
+        if key == "chunk_id":
+            return self.chunk_ids[i].item() if self.chunk_ids.dtype != object else self.chunk_ids[i]
+        if key == "file_name":
+            return self.files[self.file_code[i]][1]
+        return None
+
+    def document(self, i: int) -> Document:
+        return Document(
+            page_content=self.page_content(i),
+            metadata={key: self.value(i, key) for key in ("chunk_id", "file_id", "chunk_index", "file_name")},
+        )
+
+    def documents(self, idxs: Iterable[int]) -> List[Document]:
+        return [self.document(i) for i in idxs]
+
+    def file_codes_of(self, file_ids: Iterable[Any]) -> np.ndarray:
+        wanted = set(file_ids)
+        return np.asarray([i for i, (fid, _) in enumerate(self.files) if fid in wanted], dtype=np.int32)
+
+    # -------------------- search --------------------
+
+    def matching(self, terms: List[str]) -> List[int]:
+        """Rows whose lowercased text contains any of the (lowercase) `terms`."""
+        n = len(self)
+        if not n or not terms:
+            return []
+        if not self.is_ascii():
+            # str.lower() may change lengths, so byte offsets don't carry over
+            return [i for i in range(n) if any(t in self.page_content(i).lower() for t in terms)]
+
+        # ASCII text (byte offsets == char offsets): scan the lowered buffer
+        # term by term, jumping to the next row after each hit. Once few rows
+        # are left unmatched, probe just those rows instead.
+        lowered = self.lowered_text()
+        offsets = self.offsets.tolist()
+        hit = bytearray(n)
+        found = 0
+        for term in terms:
+            try:
+                needle = term.encode("ascii")
+            except UnicodeEncodeError:
+                continue  # cannot occur in ASCII text
+            if n - found <= n // 8:
+                for i in [i for i in range(n) if not hit[i]]:
+                    if lowered.find(needle, offsets[i], offsets[i + 1]) != -1:
+                        hit[i] = 1
+                        found += 1
+            else:
+                p = lowered.find(needle)
+                while p != -1:
+                    i = bisect_right(offsets, p) - 1
+                    if p + len(needle) > offsets[i + 1]:
+                        # Straddles two rows; not a match in either
+                        p = lowered.find(needle, p + 1)
+                        continue
+                    if not hit[i]:
+                        hit[i] = 1
+                        found += 1
+                    p = lowered.find(needle, offsets[i + 1])
+            if found == n:
+                return list(range(n))
+        return [i for i in range(n) if hit[i]]
@@ -0,0 +1,74 @@
+import time, threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from retrievers.SupabaseRetriever import SupabaseRetriever
+
+REFRESH_INTERVAL = 30        # seconds between delta syncs of a cached project
+MAX_PROJECTS = 16
+
+
+class ProjectIndexCache:
+    """
+    Process-wide loaded project indexes, keyed by project_id.
+
+    The first request for a project builds its retriever; later requests
+    reuse it and call `refresh()` at most every `refresh_interval` seconds
+    (or immediately when the caller already knows the content version moved),
+    so a newly embedded file costs a delta sync instead of a full reload.
+    A project whose embedding space changed is rebuilt from scratch.
+    Least recently used projects are evicted past `max_projects`.
+    """
+
+    def __init__(
+        self,
+        build: Callable[[str, Optional[str], Optional[str]], SupabaseRetriever],
+        refresh_interval: float = REFRESH_INTERVAL,
+        max_projects: int = MAX_PROJECTS,
+    ):
+        self._build = build
+        self._interval = float(refresh_interval)
+        self._max = int(max_projects)
+        self._lock = threading.Lock()
+        # project_id -> (retriever, last refresh time)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._project_locks: Dict[str, threading.Lock] = {}
+
+    def get(
+        self,
+        project_id: str,
+        content_version: Optional[str] = None,
+        embedding_space: Optional[str] = None,
+    ) -> SupabaseRetriever:
+        with self._lock:
+            plock = self._project_locks.setdefault(project_id, threading.Lock())
+
+        # One loader per project; other projects are not blocked meanwhile
+        with plock:
+            with self._lock:
+                entry = self._entries.get(project_id)
+            now = time.monotonic()
+            if entry is not None and embedding_space is not None \
+                    and entry[0].embedding_space != embedding_space:
+                entry = None
+            if entry is None:
+                retriever = self._build(project_id, content_version, embedding_space)
+            else:
+                retriever, last = entry
+                stale = content_version is not None and content_version != retriever.content_version
+                if stale or now - last >= self._interval:
+                    retriever.refresh()
+                else:
+                    now = last
+
+            with self._lock:
+                self._entries[project_id] = (retriever, now)
+                self._entries.move_to_end(project_id)
+                while len(self._entries) > self._max:
+                    evicted, _ = self._entries.popitem(last=False)
+                    self._project_locks.pop(evicted, None)
+            return retriever
+
+    def invalidate(self, project_id: str) -> None:
+        with self._lock:
+            self._entries.pop(project_id, None)
@@ -1,18 +1,34 @@
 import json
 import ast
+import hashlib
+import logging
 import re
 import asyncio
-from collections import defaultdict
-from typing import Any, List, Optional, Tuple
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 from supabase import Client
-from pydantic import Field
+from pydantic import Field, PrivateAttr
 
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.callbacks import CallbackManagerForRetrieverRun
-from langchain_openai import OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings
+from utils.metrics import span
+from utils.clients import get_embeddings
+from utils.embeddings import file_embedding_space, get_embedder, project_embedding_space
+from retrievers.DocumentStore import DocumentStore
+from retrievers.snapshot import read_snapshot, write_snapshot
+
+logger = logging.getLogger("virtual_ta")
+
+# Ids per `.in_()` filter; keeps request URLs well under common limits
+FILE_ID_BATCH = 100
+EMBEDDING_ID_BATCH = 100
 
 
 # -------------------- utils --------------------
@@ -87,10 +103,33 @@ class SupabaseRetriever(BaseRetriever):
     oversample: int = 2                 # how many*k to inspect before grouping
     prefer_focus_terms: bool = True     # bias target group by focus term hits
 
+    # Loading
+    page_size: int = 1000               # chunk rows per keyset page (<= PostgREST max-rows)
+    load_concurrency: int = 8           # parallel embedding fetches
+
+    # On-disk snapshots (None disables); content_version is fetched if not given
+    snapshot_dir: Optional[str] = None
+    content_version: Optional[str] = None
+
+    # Space `embeddings_model` embeds queries into (see utils.embeddings);
+    # completed files embedded in another space are left out of the index.
+    # None indexes every completed file.
+    embedding_space: Optional[str] = None
+
     # Internals
-    embeddings_model: OpenAIEmbeddings = Field(default_factory=OpenAIEmbeddings)
-    documents: List[Document] = Field(default_factory=list)
-    embeddings: List[List[float]] = Field(default_factory=list)
+    embeddings_model: Embeddings = Field(default_factory=get_embeddings)
+    # Columnar chunk store; Documents are built only for returned results
+    store: DocumentStore = Field(default_factory=DocumentStore.empty)
+    # float32 [n, dim]; read-only and memory-mapped when loaded from a snapshot
+    embeddings: np.ndarray = Field(default_factory=lambda: np.empty((0, 0), dtype=np.float32))
+    # file_id -> {"name", "updated_at"} for every completed file in the index
+    files: Dict[Any, Dict[str, Any]] = Field(default_factory=dict)
+
+    # Guards swapping store/embeddings as a pair (see refresh)
+    _swap_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    # When the indexed file set was read; orders this index's snapshot
+    # against ones other workers publish
+    _files_read_at: float = PrivateAttr(default=0.0)
 
     # Lifecycle
     def model_post_init(self, __context: Any) -> None:
@@ -98,72 +137,191 @@ class SupabaseRetriever(BaseRetriever):
 
     # ----- Load -----
     def _load_data(self) -> None:
+        if not self.snapshot_dir:
+            self._load_from_supabase()
+            return
+
+        if self.content_version is None:
+            with span("content_version"):
+                self.content_version = fetch_content_version(self.supabase, self.project_id, self.embedding_space)
+
+        with span("snapshot_read"):
+            snap = read_snapshot(self.snapshot_dir, self.project_id, self.content_version)
+        if snap is not None:
+            self.store, self.embeddings, self.files = snap
+            return
+
+        self._load_from_supabase()
+        self._write_snapshot()
+
+    def _write_snapshot(self) -> None:
+        if not self.snapshot_dir or not len(self.store):
+            return
+        with span("snapshot_write"):
+            try:
+                write_snapshot(self.snapshot_dir, self.project_id, self.content_version,
+                               self.store, self.embeddings, self.files, generation=self._files_read_at)
+            except OSError as e:
+                logger.warning(f"Could not write snapshot for project {self.project_id}: {e}")
+
+    def _fetch_completed_files(self) -> List[Dict[str, Any]]:
+        with span("load_files"):
+            self._files_read_at = time.time()
+            rows = _completed_files(self.supabase, self.project_id)
+        usable = _in_space(rows, self.embedding_space)
+        if len(usable) != len(rows):
+            logger.warning(
+                f"Project {self.project_id}: {len(rows) - len(usable)} completed files were embedded "
+                f"outside {self.embedding_space} and are not indexed until re-embedded")
+        return usable
+
+    def _load_from_supabase(self) -> None:
+        file_rows = self._fetch_completed_files()
+        self.store, self.embeddings = self._fetch_documents(file_rows)
+        self.files = {r["id"]: {"name": r.get("name"), "updated_at": r.get("updated_at")} for r in file_rows}
+        # Describe what was actually loaded, even if files changed since a
+        # content_version passed in by the caller was computed
+        self.content_version = _content_version(file_rows, self.embedding_space)
+
+    def _fetch_embeddings(self, chunk_ids: List[Any]) -> List[Dict[str, Any]]:
+        res = (
+            self.supabase.table("embeddings")
+            .select("chunk_id, embedding")
+            .in_("chunk_id", chunk_ids)
+            .execute()
+        )
+        if getattr(res, "error", None):
+            raise RuntimeError(f"Error fetching embeddings: {res.error}")
+        return res.data or []
+
+    def _fetch_documents(self, file_rows: List[Dict[str, Any]]) -> Tuple[DocumentStore, np.ndarray]:
+        """Chunks + embeddings of the given files, as a document store and a float32 matrix."""
+        empty = np.empty((0, 0), dtype=np.float32)
+
         # Helper for batching
         def chunked(iterable, n):
             for i in range(0, len(iterable), n):
                 yield iterable[i:i + n]
 
-        # 1) Fetch files
-        files_res = (
-            self.supabase.table("files")
-            .select("id,name")  # 'name' from your schema; harmless if null
-            .eq("project_id", self.project_id)
-            .eq("status", "completed")
-            .execute()
-        )
-        file_rows = files_res.data or []
+        # 1) Files
         file_ids = [r["id"] for r in file_rows]
         id_to_name = {r["id"]: r.get("name") for r in file_rows}
         if not file_ids:
-            return
+            return DocumentStore.empty(), empty
+
+        # 2) Page through chunks by keyset on id (deterministic, never
+        #    truncated by PostgREST's max-rows), and 3) fetch each page's
+        #    embeddings concurrently on a bounded pool while paging continues.
+        chunks: List[Dict[str, Any]] = []
+        futures = []
+        with ThreadPoolExecutor(max_workers=max(1, self.load_concurrency)) as pool:
+            with span("load_chunks"):
+                for file_batch in chunked(file_ids, FILE_ID_BATCH):
+                    expected = None
+                    got = 0
+                    last_id = None
+                    while True:
+                        q = (
+                            self.supabase.table("chunks")
+                            .select("id, content, file_id, chunk_index", count="exact" if last_id is None else None)
+                            .in_("file_id", file_batch)
+                            .order("id")
+                            .limit(self.page_size)
+                        )
+                        if last_id is not None:
+                            q = q.gt("id", last_id)
+                        res = q.execute()
+                        page = res.data or []
+                        if expected is None:
+                            expected = res.count
+                        if not page:
+                            break
+                        chunks.extend(page)
+                        got += len(page)
+                        last_id = page[-1]["id"]
+                        for batch in chunked([c["id"] for c in page], EMBEDDING_ID_BATCH):
+                            futures.append(pool.submit(self._fetch_embeddings, batch))
+                        if expected is not None and got >= expected:
+                            break
+                    if expected is not None and got != expected:
+                        raise RuntimeError(
+                            f"Chunk load for project {self.project_id} returned {got} rows, expected {expected}")
+            if not chunks:
+                return DocumentStore.empty(), empty
+
+            with span("load_embeddings"):
+                rows = [row for f in futures for row in f.result()]
+
+        with span("parse_embeddings"):
+            embed_map = {
+                row["chunk_id"]: _to_float_list(row["embedding"])
+                for row in rows
+            }
+        missing = len(chunks) - sum(1 for c in chunks if c["id"] in embed_map)
+        if missing:
+            logger.warning(f"Project {self.project_id}: {missing} of {len(chunks)} chunks have no embedding")
+
+        # 4) Vectors of another dimension (a different model's leftovers, e.g.
+        #    orphans of an interrupted re-embed) can't share the matrix: keep
+        #    the index's dimension, or the most common one on a cold load
+        dims = Counter(len(v) for v in embed_map.values() if v)
+        if not dims:
+            return DocumentStore.empty(), empty
+        dim = self.embeddings.shape[1] if len(self.embeddings) else dims.most_common(1)[0][0]
+        if len(dims) > 1 or dim not in dims:
+            logger.warning(
+                f"Project {self.project_id}: skipping {sum(n for d, n in dims.items() if d != dim)} "
+                f"embeddings whose dimension is not {dim} ({self.embedding_space}): {dict(dims)}")
+
+        # 5) Pack chunks that have an embedding into the store, vectors alongside
+        kept = [row for row in chunks if len(embed_map.get(row["id"]) or ()) == dim]
+        store = DocumentStore.from_rows(kept, id_to_name)
+        vectors = [embed_map[row["id"]] for row in kept]
+        return store, (np.asarray(vectors, dtype=np.float32) if vectors else empty)
+
+    # ----- Incremental refresh -----
+    def refresh(self) -> bool:
+        """
+        Bring the index up to date with the project's completed files.
 
-        # 2) Fetch chunks
-        chunks_res = (
-            self.supabase.table("chunks")
-            .select("id, content, file_id, chunk_index")
-            .in_("file_id", file_ids)
-            .execute()
-        )
-        chunks = chunks_res.data or []
-        if not chunks:
-            return
-        chunk_ids = [c["id"] for c in chunks]
-
-        # 3) Fetch embeddings in batches to avoid long URLs
-        rows = []
-        for batch in chunked(chunk_ids, 100):  # 100 is usually safe
-            res = (
-                self.supabase.table("embeddings")
-                .select("chunk_id, embedding")
-                .in_("chunk_id", batch)
-                .execute()
-            )
-            if getattr(res, "error", None):
-                raise RuntimeError(f"Error fetching embeddings: {res.error}")
-            rows.extend(res.data or [])
-
-        embed_map = {
-            row["chunk_id"]: _to_float_list(row["embedding"])
-            for row in rows
-        }
-
-        # 4) Combine chunks + embeddings into documents
-        for row in chunks:
-            vec = embed_map.get(row["id"])
-            if not vec:
-                continue
-            self.documents.append(
-                Document(
-                    page_content=row["content"],
-                    metadata={
-                        "chunk_id": row["id"],
-                        "file_id": row["file_id"],
-                        "chunk_index": row.get("chunk_index"),
-                        "file_name": id_to_name.get(row["file_id"]),
-                    },
-                )
-            )
-            self.embeddings.append(vec)
+        Only files that are new or were re-embedded (updated_at changed) have
+        their chunks and embeddings fetched; files that were deleted, failed
+        or re-embedded are dropped from the in-memory structures. Costs one
+        files query when nothing changed. Returns True if the index changed.
+        """
+        file_rows = self._fetch_completed_files()
+        version = _content_version(file_rows, self.embedding_space)
+        if version == self.content_version:
+            return False
+
+        current = {r["id"]: r for r in file_rows}
+        changed = [
+            fid for fid, r in current.items()
+            if fid not in self.files or str(self.files[fid].get("updated_at")) != str(r.get("updated_at"))
+        ]
+        dropped = {fid for fid in self.files if fid not in current} | {fid for fid in changed if fid in self.files}
+
+        with span("refresh_fetch"):
+            new_store, new_vecs = self._fetch_documents([current[fid] for fid in changed])
+
+        with span("refresh_merge"):
+            store, embeddings = self.store, self.embeddings
+            if dropped:
+                keep = np.flatnonzero(~np.isin(store.file_code, store.file_codes_of(dropped)))
+                store = store.select(keep)
+                embeddings = embeddings[keep] if len(embeddings) else embeddings
+            if len(new_store):
+                store = store.concat(new_store)
+                embeddings = np.concatenate([embeddings, new_vecs]) if len(embeddings) else new_vecs
+
+        with self._swap_lock:
+            self.store, self.embeddings = store, embeddings
+        self.files = {fid: {"name": r.get("name"), "updated_at": r.get("updated_at")} for fid, r in current.items()}
+        self.content_version = version
+        logger.info(f"Refreshed project {self.project_id}: +{len(changed)} / -{len(dropped)} files")
+
+        self._write_snapshot()
+        return True
 
     # ----- Neighbor expansion -----
     def _neighbor_expand(self, base_idxs: List[int], window: int) -> List[int]:
@@ -172,11 +330,12 @@ class SupabaseRetriever(BaseRetriever):
         using metadata['chunk_index'] when available.
         """
         key = self.grouping_key
+        store = self.store
         # Build group -> [(chunk_index, doc_idx)] sorted by index
         by_group: dict[str, List[Tuple[int, int]]] = {}
-        for i, d in enumerate(self.documents):
-            gid = d.metadata.get(key)
-            ci = d.metadata.get("chunk_index")
+        for i in range(len(store)):
+            gid = store.value(i, key)
+            ci = store.value(i, "chunk_index")
             if gid is None or ci is None:
                 continue
             by_group.setdefault(gid, []).append((int(ci), i))
@@ -186,8 +345,8 @@ class SupabaseRetriever(BaseRetriever):
         expanded = list(base_idxs)
         seen = set(base_idxs)
         for si in base_idxs:
-            gid = self.documents[si].metadata.get(key)
-            ci = self.documents[si].metadata.get("chunk_index")
+            gid = store.value(si, key)
+            ci = store.value(si, "chunk_index")
             if gid not in by_group or ci is None:
                 continue
             ci = int(ci)
@@ -203,10 +362,18 @@ class SupabaseRetriever(BaseRetriever):
     query: str,
     *,
     run_manager: Optional[CallbackManagerForRetrieverRun] = None,
+    k: Optional[int] = None,
+    query_vector: Optional[List[float]] = None,
 ) -> List[Document]:
-        if not self.embeddings or not self.documents:
+        with self._swap_lock:
+            store, embeddings = self.store, self.embeddings
+        if not len(embeddings) or not len(store):
             return []
 
+        # Per-call top-k (e.g. from the retrieval tool); falls back to self.k
+        k = k or self.k
+        # query_vector: caller already embedded `query` (skips embed_query)
+
         # === Optional knobs (set on the instance; all are optional) ===
         # self.lexical_prefilter: bool | None
         # self.per_file_cap: int | None                # max docs per file in final selection
@@ -242,32 +409,33 @@ class SupabaseRetriever(BaseRetriever):
                     out.append(t)
             return out
 
-        def _text_has_any(text: str, terms: list[str]) -> bool:
-            tl = (text or "").lower()
-            return any(t in tl for t in terms)
-
         # ---------- candidate set (optional lexical prefilter) ----------
-        candidate_idxs = list(range(len(self.documents)))
+        candidate_idxs = list(range(len(store)))
         if lexical_prefilter:
-            must_terms = _query_terms(query)
-            if must_terms:
-                filtered = [i for i, d in enumerate(self.documents) if _text_has_any(d.page_content, must_terms)]
-                if filtered:
-                    candidate_idxs = filtered
+            with span("lexical_prefilter"):
+                must_terms = _query_terms(query)
+                if must_terms:
+                    filtered = store.matching(must_terms)
+                    if filtered:
+                        candidate_idxs = filtered
 
         if not candidate_idxs:
             return []
 
         # ---------- dense scoring on candidates ----------
-        q_vec = np.array(self.embeddings_model.embed_query(query), dtype=float)
-        M = np.array([self.embeddings[i] for i in candidate_idxs], dtype=float)
-        qn = np.linalg.norm(q_vec)
-        if qn == 0 or M.size == 0:
-            return []
+        if query_vector is None:
+            with span("embed_query"):
+                query_vector = self.embeddings_model.embed_query(query)
+        q_vec = np.asarray(query_vector, dtype=np.float32)
+        with span("score"):
+            M = embeddings[candidate_idxs]
+            qn = np.linalg.norm(q_vec)
+            if qn == 0 or M.size == 0:
+                return []
 
-        denom = (np.linalg.norm(M, axis=1) * qn)
-        denom[denom == 0] = 1e-12
-        sims = (M @ q_vec) / denom
+            denom = (np.linalg.norm(M, axis=1) * qn)
+            denom[denom == 0] = 1e-12
+            sims = (M @ q_vec) / denom
 
         # ---------- optional “abstain” (no fixed threshold; quantile-based if provided) ----------
         if min_sim_quantile is not None:
@@ -277,7 +445,7 @@ class SupabaseRetriever(BaseRetriever):
                 return []
 
         # ---------- diverse selection across files (no fixed fractions unless provided) ----------
-        take = max(self.k * self.oversample, self.k + 10)
+        take = max(k * self.oversample, k + 10)
         order = np.argsort(sims)[-take:][::-1]  # best → worst among candidates
         pool = [(float(sims[j]), candidate_idxs[j]) for j in order]
 
@@ -286,9 +454,9 @@ class SupabaseRetriever(BaseRetriever):
         group_key = self.grouping_key
 
         # Phase 1: enforce diversity for the first X% of k if configured
-        first_target = int(self.k * diversity_first_frac) if diversity_first_frac else 0
+        first_target = int(k * diversity_first_frac) if diversity_first_frac else 0
         for sc, idx in pool:
-            gid = self.documents[idx].metadata.get(group_key)
+            gid = store.value(idx, group_key)
             if first_target and len(picked) < first_target:
                 # pick if new group or under per-file cap
                 if per_file_cap is None or used_groups.get(gid, 0) < per_file_cap:
@@ -300,18 +468,18 @@ class SupabaseRetriever(BaseRetriever):
 
         # Phase 2: fill remaining purely by score, respecting per-file cap if set
         for sc, idx in pool:
-            if len(picked) >= self.k:
+            if len(picked) >= k:
                 break
             if idx in picked:
                 continue
-            gid = self.documents[idx].metadata.get(group_key)
+            gid = store.value(idx, group_key)
             if per_file_cap is not None and used_groups.get(gid, 0) >= per_file_cap:
                 continue
             picked.append(idx)
             used_groups[gid] = used_groups.get(gid, 0) + 1
 
-        chosen = picked[: self.k]
-        return [self.documents[i] for i in chosen]
+        chosen = picked[:k]
+        return store.documents(chosen)
 
 
     async def _aget_relevant_documents(
@@ -319,11 +487,69 @@ class SupabaseRetriever(BaseRetriever):
         query: str,
         *,
         run_manager: Optional[CallbackManagerForRetrieverRun] = None,
+        k: Optional[int] = None,
+        query_vector: Optional[List[float]] = None,
     ) -> List[Document]:
         return await asyncio.to_thread(
-            self._get_relevant_documents, query, run_manager=run_manager
+            self._get_relevant_documents, query, run_manager=run_manager, k=k, query_vector=query_vector
         )
 
 
-def build_supabase_retriever(supabase: Client, project_id: str) -> SupabaseRetriever:
-    return SupabaseRetriever(supabase=supabase, project_id=project_id)
\ No newline at end of file
+def build_supabase_retriever(
+    supabase: Client,
+    project_id: str,
+    *,
+    snapshot_dir: Optional[str] = None,
+    content_version: Optional[str] = None,
+    embedding_space: Optional[str] = None,
+) -> SupabaseRetriever:
+    """Retriever embedding queries in the project's space (looked up if not given)."""
+    if embedding_space is None:
+        embedding_space = project_embedding_space(supabase, project_id)
+    return SupabaseRetriever(
+        supabase=supabase,
+        project_id=project_id,
+        snapshot_dir=snapshot_dir,
+        content_version=content_version,
+        embedding_space=embedding_space,
+        embeddings_model=get_embedder(embedding_space),
+    )
+
+
+def fetch_content_version(supabase: Client, project_id: str, embedding_space: Optional[str] = None) -> str:
+    """
+    Fingerprint of a project's indexable file set: changes whenever a file is
+    added, removed, fails or is re-embedded, and with the embedding space.
+    Re-embedding shows up through files.updated_at, which a trigger bumps on
+    every status change (supabase/migrations/..._files_updated_at.sql).
+    """
+    rows = _completed_files(supabase, project_id)
+    return _content_version(_in_space(rows, embedding_space), embedding_space)
+
+
+def _completed_files(supabase: Client, project_id: str) -> List[Dict[str, Any]]:
+    # Runs on every refresh: fetch only what versioning and the index need
+    res = (
+        supabase.table("files")
+        .select("id, name, updated_at, embedding_space")
+        .eq("project_id", project_id)
+        .eq("status", "completed")
+        .execute()
+    )
+    return res.data or []
+
+
+def _in_space(file_rows: List[Dict[str, Any]], embedding_space: Optional[str]) -> List[Dict[str, Any]]:
+    if embedding_space is None:
+        return file_rows
+    return [r for r in file_rows if file_embedding_space(r) == embedding_space]
+
+
+def _content_version(file_rows: List[Dict[str, Any]], embedding_space: Optional[str] = None) -> str:
+    rows = sorted((str(r["id"]), str(r.get("updated_at"))) for r in file_rows)
+    h = hashlib.sha1()
+    if embedding_space is not None:
+        h.update(f"{embedding_space};".encode("utf-8"))
+    for fid, updated_at in rows:
+        h.update(f"{fid}:{updated_at};".encode("utf-8"))
+    return h.hexdigest()
@@ -0,0 +1,162 @@
+"""
+Versioned on-disk snapshots of a project's retrieval index.
+
+Layout (one directory per content version, swapped in atomically):
+
+    <root>/<project_id>/<content_version>/
+        vectors.npy       float32 [n, dim], opened with mmap_mode="r"
+        text.bin          utf-8 chunk texts, back to back
+        lowered.bin       text.bin lowercased, for the keyword prefilter
+                          (ASCII text only)
+        offsets.npy       int64 [n + 1] byte offsets into text.bin
+        chunk_index.npy   int32 [n] (-1 when missing)
+        file_code.npy     int32 [n] index into meta["files"]
+        meta.json         format, version, generation, ascii, chunk ids,
+                          files (id/name/updated_at)
+
+This is `DocumentStore`'s own column layout, so loading wraps the files
+without building per-chunk objects. Vectors and both texts are memory-mapped
+read-only, so every worker process on the host shares the same page-cache
+pages, and a restarted worker is warm as soon as the OS cache is.
+"""
+import json
+import logging
+import mmap
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from retrievers.DocumentStore import DocumentStore, id_column
+
+logger = logging.getLogger("virtual_ta")
+
+SNAPSHOT_FORMAT = 3
+
+
+def _project_dir(root: str, project_id: str) -> Path:
+    return Path(root) / str(project_id)
+
+
+def read_snapshot(
+    root: str, project_id: str, version: str
+) -> Optional[Tuple[DocumentStore, np.ndarray, Dict[Any, Dict[str, Any]]]]:
+    """
+    The document store, a read-only memory-mapped vector matrix and the
+    indexed files (file_id -> {name, updated_at}), or None if absent/unusable.
+    """
+    path = _project_dir(root, project_id) / version
+    try:
+        meta = json.loads((path / "meta.json").read_text())
+        if meta.get("format") != SNAPSHOT_FORMAT or meta.get("version") != version:
+            return None
+        vectors = np.load(path / "vectors.npy", mmap_mode="r")
+        offsets = np.load(path / "offsets.npy")
+        chunk_index = np.load(path / "chunk_index.npy")
+        file_code = np.load(path / "file_code.npy")
+        text = np.memmap(path / "text.bin", dtype=np.uint8, mode="r") if offsets[-1] else np.empty(0, np.uint8)
+        ascii = bool(meta["ascii"])
+        lowered = None
+        if ascii:
+            lowered = _map_bytes(path / "lowered.bin") if offsets[-1] else b""
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Ignoring unreadable snapshot {path}: {e}")
+        return None
+
+    files = meta["files"]
+    store = DocumentStore(
+        text, offsets, id_column(meta["chunk_ids"]), file_code, chunk_index,
+        [(f["id"], f["name"]) for f in files],
+        lowered, ascii,
+    )
+    indexed = {f["id"]: {"name": f["name"], "updated_at": f.get("updated_at")} for f in files}
+    return store, vectors, indexed
+
+
+def write_snapshot(
+    root: str,
+    project_id: str,
+    version: str,
+    store: DocumentStore,
+    vectors: np.ndarray,
+    files: Dict[Any, Dict[str, Any]],
+    generation: float = 0.0,
+) -> None:
+    """
+    Write a snapshot for `version` and drop the project's older versions.
+    `files` lists every indexed file, including ones that produced no chunks.
+    `generation` is when the indexed file set was read (a timestamp): only
+    versions with an earlier generation are dropped, so a worker finishing
+    a slow load of stale content never deletes a newer worker's snapshot.
+    """
+    project_dir = _project_dir(root, project_id)
+    final = project_dir / version
+    if final.exists():
+        return
+    project_dir.mkdir(parents=True, exist_ok=True)
+    tmp = project_dir / f".tmp-{uuid.uuid4().hex}"
+    tmp.mkdir()
+    try:
+        file_list = [{"id": fid, "name": f.get("name"), "updated_at": f.get("updated_at")}
+                     for fid, f in files.items()]
+        codes = {f["id"]: i for i, f in enumerate(file_list)}
+        remap = np.empty(len(store.files), dtype=np.int32)
+        for j, (fid, name) in enumerate(store.files):
+            if fid not in codes:
+                codes[fid] = len(file_list)
+                file_list.append({"id": fid, "name": name, "updated_at": None})
+            remap[j] = codes[fid]
+        file_code = remap[store.file_code] if len(store) else np.empty(0, dtype=np.int32)
+        (tmp / "text.bin").write_bytes(np.asarray(store.text).tobytes())
+        ascii = store.is_ascii()
+        if ascii:
+            with open(tmp / "lowered.bin", "wb") as f:
+                f.write(store.lowered_text())
+        np.save(tmp / "offsets.npy", np.asarray(store.offsets, dtype=np.int64))
+        np.save(tmp / "chunk_index.npy", np.asarray(store.chunk_index, dtype=np.int32))
+        np.save(tmp / "file_code.npy", file_code.astype(np.int32, copy=False))
+        np.save(tmp / "vectors.npy", np.ascontiguousarray(vectors, dtype=np.float32))
+        # meta.json last: its presence marks a complete snapshot
+        (tmp / "meta.json").write_text(json.dumps({
+            "format": SNAPSHOT_FORMAT,
+            "version": version,
+            "generation": generation,
+            "ascii": ascii,
+            "count": len(store),
+            "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+            "chunk_ids": store.chunk_ids.tolist(),
+            "files": file_list,
+        }))
+        try:
+            os.rename(tmp, final)
+        except OSError:
+            # Another worker published the same version first
+            return
+    finally:
+        if tmp.exists():
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    # Older versions can go; processes that still map them keep their pages.
+    # Newer ones are left to the worker that wrote them.
+    for old in project_dir.iterdir():
+        if old.name != version and not old.name.startswith(".tmp-") and _generation(old) < generation:
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def _map_bytes(path: Path) -> mmap.mmap:
+    with open(path, "rb") as f:
+        # The mapping outlives the file object
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _generation(path: Path) -> float:
+    # Unreadable or pre-generation snapshots count as oldest
+    try:
+        return float(json.loads((path / "meta.json").read_text()).get("generation", 0.0))
+    except (OSError, ValueError, TypeError):
+        return 0.0
@@ -0,0 +1,190 @@
+import asyncio, math, time
+from collections import OrderedDict, deque
+from typing import Deque, Dict
+
+MAX_CONCURRENT = 64          # chat turns in flight per worker (0 = unlimited)
+MAX_PER_PROJECT = 16         # of which one project may hold at most
+MAX_QUEUE = 256              # waiters across all projects
+MAX_QUEUE_PER_PROJECT = 64   # waiters for a single project
+QUEUE_TIMEOUT = 10.0         # seconds a waiter may queue before being shed
+RETRY_AFTER_MAX = 30         # seconds
+
+
+class Overloaded(Exception):
+    """Request shed by admission control; retry after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: int, status_code: int = 503):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class Ticket:
+    """A granted slot. Release it exactly once; extra releases are no-ops."""
+
+    __slots__ = ("project_id", "granted_at", "waited", "_owner")
+
+    def __init__(self, owner: "AdmissionControl", project_id: str, waited: float):
+        self.project_id = project_id
+        self.granted_at = time.monotonic()
+        self.waited = waited
+        self._owner = owner
+
+    def release(self) -> None:
+        owner, self._owner = self._owner, None
+        if owner is not None:
+            owner._release(self)
+
+
+class AdmissionControl:
+    """
+    Per-worker admission control for chat turns.
+
+    At most `max_concurrent` turns run at once, and at most `max_per_project`
+    of them for any one project. Requests over the limit wait in a per-project
+    FIFO; freed slots are handed out round-robin across projects with
+    waiters, so one class hammering the service before an exam queues behind
+    its own requests instead of everyone else's. A request is shed with
+    `Overloaded` straight away when its queue (or the global queue) is full,
+    or once it has waited `queue_timeout` seconds.
+
+    Runs on the event loop only: acquire/release are not thread-safe.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT,
+        max_per_project: int = MAX_PER_PROJECT,
+        max_queue: int = MAX_QUEUE,
+        max_queue_per_project: int = MAX_QUEUE_PER_PROJECT,
+        queue_timeout: float = QUEUE_TIMEOUT,
+    ):
+        self._max = int(max_concurrent)
+        self._max_project = int(max_per_project)
+        self._max_queue = int(max_queue)
+        self._max_queue_project = int(max_queue_per_project)
+        self._timeout = float(queue_timeout)
+
+        self._running = 0
+        self._running_by_project: Dict[str, int] = {}
+        # project_id -> waiters, in round-robin order
+        self._waiting: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._queued = 0
+        self._shed = 0
+        self._admitted = 0
+        # EWMA of how long a slot is held, for Retry-After
+        self._hold = 1.0
+
+    # -------------------- public API --------------------
+
+    async def acquire(self, project_id: str) -> Ticket:
+        if self._max <= 0:
+            return Ticket(self, project_id, 0.0)
+
+        # Waiting projects with room would already have been dispatched, so
+        # room here never jumps anyone's queue
+        if project_id not in self._waiting and self._has_room(project_id):
+            self._take(project_id)
+            return Ticket(self, project_id, 0.0)
+
+        waiters = self._waiting.get(project_id)
+        if self._queued >= self._max_queue:
+            self._shed += 1
+            raise Overloaded("server busy", self._retry_after(self._queued))
+        if waiters is not None and len(waiters) >= self._max_queue_project:
+            self._shed += 1
+            raise Overloaded("too many requests for this project", self._retry_after(len(waiters)), 429)
+
+        fut = asyncio.get_running_loop().create_future()
+        if waiters is None:
+            waiters = self._waiting[project_id] = deque()
+        waiters.append(fut)
+        self._queued += 1
+        t0 = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self._timeout)
+        except asyncio.CancelledError:
+            # Client went away while queued
+            if fut.done() and not fut.cancelled():
+                self._release_slot(project_id)
+            else:
+                fut.cancel()
+                self._forget(project_id, fut)
+            raise
+        except asyncio.TimeoutError:
+            if not (fut.done() and not fut.cancelled()):
+                fut.cancel()
+                self._forget(project_id, fut)
+                self._shed += 1
+                raise Overloaded("queue timeout", self._retry_after(self._queued))
+            # Granted just as the wait timed out: keep the slot
+        return Ticket(self, project_id, time.monotonic() - t0)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self._running,
+            "queued": self._queued,
+            "projects_waiting": len(self._waiting),
+            "admitted_total": self._admitted,
+            "shed_total": self._shed,
+        }
+
+    # -------------------- internals --------------------
+
+    def _has_room(self, project_id: str) -> bool:
+        return (self._running < self._max
+                and self._running_by_project.get(project_id, 0) < self._max_project)
+
+    def _take(self, project_id: str) -> None:
+        self._running += 1
+        self._running_by_project[project_id] = self._running_by_project.get(project_id, 0) + 1
+        self._admitted += 1
+
+    def _release(self, ticket: Ticket) -> None:
+        if self._max <= 0:
+            return
+        held = time.monotonic() - ticket.granted_at
+        self._hold = 0.9 * self._hold + 0.1 * held
+        self._release_slot(ticket.project_id)
+
+    def _release_slot(self, project_id: str) -> None:
+        self._running -= 1
+        n = self._running_by_project.get(project_id, 0) - 1
+        if n > 0:
+            self._running_by_project[project_id] = n
+        else:
+            self._running_by_project.pop(project_id, None)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Grant free slots to waiting projects, one waiter per project per pass."""
+        while self._waiting and self._running < self._max:
+            for project_id in list(self._waiting):
+                if self._has_room(project_id):
+                    break
+            else:
+                return  # every waiting project is at its own limit
+            waiters = self._waiting.pop(project_id)
+            fut = waiters.popleft()
+            self._queued -= 1
+            if waiters:
+                self._waiting[project_id] = waiters  # to the back of the rotation
+            self._take(project_id)
+            fut.set_result(None)
+
+    def _forget(self, project_id: str, fut: asyncio.Future) -> None:
+        waiters = self._waiting.get(project_id)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(fut)
+        except ValueError:
+            return
+        self._queued -= 1
+        if not waiters:
+            del self._waiting[project_id]
+
+    def _retry_after(self, ahead: int) -> int:
+        slots = max(1, self._max)
+        return max(1, min(RETRY_AFTER_MAX, math.ceil(self._hold * (ahead / slots + 1))))
@@ -0,0 +1,110 @@
+import time, threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+TTL_SECONDS = 24 * 60 * 60   # answers go stale even if nothing changed
+MAX_ENTRIES = 200            # per project
+MAX_PROJECTS = 500
+
+
+class _ProjectAnswers:
+    def __init__(self, version: str, dim: int):
+        self.version = version
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.answers: List[str] = []
+        self.stored_at: List[float] = []
+
+
+class AnswerCache:
+    """
+    In-process cache of final answers to first-turn questions, per project.
+
+    Lookups compare the (unit-normalised) query embedding against previously
+    answered questions and return the best answer whose cosine similarity is
+    at least `threshold`. Each project's entries are tagged with a content
+    version; a lookup or store with a different version drops them all, so a
+    changed file set or style config invalidates the project automatically.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        ttl_seconds: int = TTL_SECONDS,
+        max_entries: int = MAX_ENTRIES,
+        max_projects: int = MAX_PROJECTS,
+    ):
+        self.threshold = float(threshold)
+        self._ttl = ttl_seconds
+        self._max_entries = int(max_entries)
+        self._max_projects = int(max_projects)
+        self._lock = threading.Lock()
+        self._projects: "OrderedDict[str, _ProjectAnswers]" = OrderedDict()
+
+    @staticmethod
+    def _unit(vec) -> Optional[np.ndarray]:
+        v = np.asarray(vec, dtype=np.float32)
+        n = float(np.linalg.norm(v))
+        return v / n if n else None
+
+    def _project(self, project_id: str, version: str) -> Optional[_ProjectAnswers]:
+        entry = self._projects.get(project_id)
+        if entry is not None and entry.version != version:
+            self._projects.pop(project_id, None)
+            return None
+        if entry is not None:
+            self._projects.move_to_end(project_id)
+        return entry
+
+    def lookup(self, project_id: str, version: str, query_vec) -> Optional[str]:
+        v = self._unit(query_vec)
+        if v is None:
+            return None
+        with self._lock:
+            entry = self._project(project_id, version)
+            if entry is None or not entry.answers or entry.vectors.shape[1] != v.shape[0]:
+                return None
+            self._expire(entry)
+            if not entry.answers:
+                return None
+            sims = entry.vectors @ v
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+            return entry.answers[best]
+
+    def store(self, project_id: str, version: str, query_vec, answer: str) -> None:
+        v = self._unit(query_vec)
+        if v is None or not (answer or "").strip():
+            return
+        with self._lock:
+            entry = self._project(project_id, version)
+            if entry is None or entry.vectors.shape[1] != v.shape[0]:
+                entry = _ProjectAnswers(version, v.shape[0])
+                self._projects[project_id] = entry
+                while len(self._projects) > self._max_projects:
+                    self._projects.popitem(last=False)
+
+            # Oldest entries go first once the project is full
+            if len(entry.answers) >= self._max_entries:
+                drop = len(entry.answers) - self._max_entries + 1
+                entry.vectors = entry.vectors[drop:]
+                del entry.answers[:drop]
+                del entry.stored_at[:drop]
+            entry.vectors = np.vstack([entry.vectors, v[None, :]])
+            entry.answers.append(answer)
+            entry.stored_at.append(time.time())
+
+    def _expire(self, entry: _ProjectAnswers) -> None:
+        """Drop entries older than the TTL, so they neither match nor shadow a fresh one."""
+        fresh = np.asarray(entry.stored_at) >= time.time() - self._ttl
+        if fresh.all():
+            return
+        entry.vectors = entry.vectors[fresh]
+        entry.answers = [a for a, keep in zip(entry.answers, fresh) if keep]
+        entry.stored_at = [t for t, keep in zip(entry.stored_at, fresh) if keep]
+
+    def invalidate(self, project_id: str) -> None:
+        with self._lock:
+            self._projects.pop(project_id, None)
@@ -0,0 +1,129 @@
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+import tiktoken
+from langchain_core.documents import Document
+
+logger = logging.getLogger("virtual_ta")
+
+# Ingestion splits with chunk_overlap=100 tokens; a few KB of tail is plenty
+MAX_OVERLAP_CHARS = 4000
+_PROBE_CHARS = 32
+# Don't bother sending a truncated tail shorter than this
+MIN_PARTIAL_TOKENS = 64
+
+
+@lru_cache(maxsize=8)
+def get_encoder(model: str):
+    """tiktoken encoding for `model`, or None (char estimate) if it can't be loaded."""
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # e.g. encoding file not cached and no network
+        logger.warning(f"tiktoken unavailable for {model}, estimating tokens: {e}")
+        return None
+
+
+def count_tokens(encoder, text: str) -> int:
+    if encoder is None:
+        return (len(text) + 3) // 4
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(encoder, text: str, max_tokens: int) -> str:
+    if encoder is None:
+        return text[: max_tokens * 4]
+    toks = encoder.encode(text, disallowed_special=())
+    return text if len(toks) <= max_tokens else encoder.decode(toks[:max_tokens])
+
+
+def merge_overlap(a: str, b: str) -> str:
+    """Append `b` to `a`, dropping the longest prefix of `b` that repeats the tail of `a`."""
+    if not a:
+        return b
+    if not b:
+        return a
+    probe = b[:_PROBE_CHARS]
+    pos = a.find(probe, max(0, len(a) - MAX_OVERLAP_CHARS))
+    while pos != -1:
+        if b.startswith(a[pos:]):
+            return a + b[len(a) - pos:]
+        pos = a.find(probe, pos + 1)
+    return a + "\n" + b
+
+
+def pack_snippets(
+    docs: List[Document],
+    *,
+    encoder,
+    token_budget: int,
+    snippet_token_limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Turn ranked retriever hits into tool snippets that fit `token_budget`.
+
+    Hits from the same file with consecutive chunk_index are merged into one
+    snippet (removing the text duplicated by the splitter's overlap). Merged
+    runs keep the rank of their best hit and are packed greedily; the first
+    run that doesn't fit is truncated to the remaining budget.
+    """
+    # 1) Group hits into runs of adjacent chunks per file
+    seen = set()
+    by_file: Dict[Any, List[tuple]] = {}
+    loose: List[tuple] = []
+    for rank, d in enumerate(docs):
+        meta = d.metadata or {}
+        cid = meta.get("chunk_id")
+        if cid is not None:
+            if cid in seen:
+                continue
+            seen.add(cid)
+        fid, ci = meta.get("file_id"), meta.get("chunk_index")
+        if fid is None or ci is None:
+            loose.append((rank, [d]))
+        else:
+            by_file.setdefault(fid, []).append((int(ci), rank, d))
+
+    runs: List[tuple] = list(loose)
+    for hits in by_file.values():
+        hits.sort(key=lambda t: t[0])
+        cur, cur_rank, prev_ci = [], None, None
+        for ci, rank, d in hits:
+            if cur and ci - prev_ci > 1:
+                runs.append((cur_rank, cur))
+                cur, cur_rank = [], None
+            cur.append(d)
+            cur_rank = rank if cur_rank is None else min(cur_rank, rank)
+            prev_ci = ci
+        if cur:
+            runs.append((cur_rank, cur))
+    runs.sort(key=lambda t: t[0])
+
+    # 2) Greedy packing into the token budget
+    snippets: List[Dict[str, Any]] = []
+    used = 0
+    for _, run in runs:
+        remaining = token_budget - used
+        if remaining < MIN_PARTIAL_TOKENS:
+            break
+        text = ""
+        for d in run:
+            text = merge_overlap(text, (d.page_content or "").strip())
+        n = count_tokens(encoder, text)
+        cap = min(remaining, snippet_token_limit or remaining)
+        if n > cap:
+            text = truncate_tokens(encoder, text, cap)
+            n = cap
+        meta = run[0].metadata or {}
+        snippets.append({
+            "text": text,
+            "title": meta.get("file_name") or meta.get("title") or meta.get("source") or "Course material",
+            "page": meta.get("page"),
+            "id": meta.get("chunk_id") or meta.get("doc_id") or meta.get("source"),
+        })
+        used += n
+    return snippets
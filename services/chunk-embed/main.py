@@ -1,18 +1,25 @@
 import os
+import time
+import logging
 import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 import asyncio
 
 import uuid
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
-from supabase import create_client, Client
+from functools import lru_cache
+from typing import Dict, List
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
+from supabase import Client
 
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredMarkdownLoader, UnstructuredWordDocumentLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
 
-from utils.security import get_user_id_from_request, assert_file_owned
+from utils.security import get_user_id_from_request, assert_file_owned, assert_files_owned
+from utils import metrics
+from utils.clients import create_supabase_client
+from utils.embeddings import DEFAULT_SPACE, get_embedder, project_embedding_space, space_columns
 
 load_dotenv()
 
@@ -20,13 +27,20 @@ APP_ENV = os.getenv("APP_ENV")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "50"))
+
+EMB_BATCH = 128  # texts per embeddings request; tune as needed for rate limits
+DB_BATCH = 500   # rows per PostgREST insert
+ID_BATCH = 100   # ids per `.in_()` filter; keeps request URLs well under common limits
+
+logger = logging.getLogger("virtual_ta")
 
 app = FastAPI()
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase: Client = create_supabase_client(SUPABASE_URL, SUPABASE_KEY)
 
 
-# TODO: Determine best embeddings
-embeddings_model = OpenAIEmbeddings(model="text-embedding-3-small")
+# Default backend's embedder; projects may pick another (utils.embeddings)
+embeddings_model = get_embedder(DEFAULT_SPACE)
 
 SUPPORTED_TYPES = {
     ".pdf": PyPDFLoader,
@@ -41,10 +55,21 @@ async def status_check():
     return {"status": "ok", "message": "Embedding service is live"}
 
 
+if metrics.METRICS_ENABLED:
+    @app.get('/metrics')
+    async def metrics_endpoint():
+        return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.post('/')
-async def embed_file(request: Request, file_id: str = Form(...), file: UploadFile = File(...)):
-    user_id = get_user_id_from_request(request)
-    assert_file_owned(supabase, file_id, user_id)
+async def embed_file(request: Request, response: Response, file_id: str = Form(...), file: UploadFile = File(...)):
+    timings = metrics.begin_request()
+    t_request = time.perf_counter()
+
+    with metrics.span("auth"):
+        user_id = get_user_id_from_request(request)
+        project_id = assert_file_owned(supabase, file_id, user_id)
+        space = project_embedding_space(supabase, project_id)
 
     ext = os.path.splitext(file.filename)[1].lower()
 
@@ -57,30 +82,22 @@ async def embed_file(request: Request, file_id: str = Form(...), file: UploadFil
 
     temp_path = Path(tempfile.gettempdir()) / f"{uuid.uuid4()}_{file.filename}"
     try:
-        contents = await file.read()
-        temp_path.write_bytes(contents)
+        with metrics.span("read_upload"):
+            contents = await file.read()
+            temp_path.write_bytes(contents)
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Could not persist upload: {e}")
 
     try:
-        loader_cls = SUPPORTED_TYPES[ext]
-        loader = loader_cls(temp_path)
-        documents = loader.load()
+        chunks = await asyncio.to_thread(load_and_split, ext, temp_path)
 
-        # TODO: Determine best chunk_size and chunk_overlap
-        splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-            encoding_name="cl100k_base",
-            chunk_size=500,
-            chunk_overlap=100,
-            add_start_index=True,
-        )
-        chunks = splitter.split_documents(documents)
+        # Off the event loop: the local backend embeds on this process's CPU
+        await asyncio.to_thread(save_chunks_and_embeddings, file_id, chunks, space)
 
-        save_chunks_and_embeddings(file_id, chunks)
-
-        supabase.table("files").update(
-            {"status": "completed"}).eq("id", file_id).execute()
+        with metrics.span("status_update"):
+            supabase.table("files").update(
+                {"status": "completed", **space_columns(space)}).eq("id", file_id).execute()
 
     except Exception as e:
         supabase.table("files").update(
@@ -91,12 +108,93 @@ async def embed_file(request: Request, file_id: str = Form(...), file: UploadFil
     finally:
         os.remove(temp_path)
 
+    if metrics.METRICS_ENABLED:
+        metrics.record("total", time.perf_counter() - t_request)
+        response.headers["Server-Timing"] = metrics.server_timing(timings)
+
     return {
         "message": f"Embedded {file.filename} successfully",
         "chunks": len(chunks),
     }
 
 
+@app.post('/bulk')
+async def embed_files(
+    request: Request,
+    response: Response,
+    project_id: str = Form(...),
+    file_ids: List[str] = Form(...),
+    files: List[UploadFile] = File(...),
+):
+    """
+    Embed many files of one project in one request. `file_ids[i]` names the
+    row for `files[i]`. Chunks from all files share embedding and insert
+    batches; each file gets its own completed/failed status in the response.
+    """
+    timings = metrics.begin_request()
+    t_request = time.perf_counter()
+
+    if len(file_ids) != len(files):
+        raise HTTPException(
+            status_code=400, detail="file_ids and files must have the same length")
+    if len(set(file_ids)) != len(file_ids):
+        raise HTTPException(status_code=400, detail="duplicate file_id")
+    if len(files) > BULK_MAX_FILES:
+        raise HTTPException(
+            status_code=400, detail=f"At most {BULK_MAX_FILES} files per request")
+
+    with metrics.span("auth"):
+        user_id = get_user_id_from_request(request)
+        assert_files_owned(supabase, project_id, file_ids, user_id)
+        space = project_embedding_space(supabase, project_id)
+
+    results: Dict[str, dict] = {}
+    file_chunks: Dict[str, list] = {}
+    for file_id, file in zip(file_ids, files):
+        results[file_id] = {"file_id": file_id, "name": file.filename}
+        ext = os.path.splitext(file.filename)[1].lower()
+        if ext not in SUPPORTED_TYPES:
+            results[file_id].update(status="failed", error=f"Unsupported file type: {ext}")
+            continue
+
+        temp_path = Path(tempfile.gettempdir()) / f"{uuid.uuid4()}_{file.filename}"
+        try:
+            with metrics.span("read_upload"):
+                temp_path.write_bytes(await file.read())
+            # A batch holds up to BULK_MAX_FILES PDFs; parse them off the loop
+            file_chunks[file_id] = await asyncio.to_thread(load_and_split, ext, temp_path)
+        except Exception as e:
+            results[file_id].update(status="failed", error=f"Error processing file: {e}")
+        finally:
+            if temp_path.exists():
+                os.remove(temp_path)
+
+    errors = await asyncio.to_thread(save_files_chunks_and_embeddings, file_chunks, space)
+    for file_id, chunks in file_chunks.items():
+        if file_id in errors:
+            results[file_id].update(status="failed", error=f"Error processing file: {errors[file_id]}")
+        else:
+            results[file_id].update(status="completed", chunks=len(chunks))
+
+    with metrics.span("status_update"):
+        for status, extra in (("completed", space_columns(space)), ("failed", {})):
+            ids = [fid for fid, r in results.items() if r["status"] == status]
+            if ids:
+                supabase.table("files").update(
+                    {"status": status, **extra}).in_("id", ids).execute()
+
+    if metrics.METRICS_ENABLED:
+        metrics.record("total", time.perf_counter() - t_request)
+        response.headers["Server-Timing"] = metrics.server_timing(timings)
+
+    return {
+        "project_id": project_id,
+        "completed": sum(r["status"] == "completed" for r in results.values()),
+        "failed": sum(r["status"] == "failed" for r in results.values()),
+        "files": [results[fid] for fid in file_ids],
+    }
+
+
 def check_file_id(file_id):
     file_check = supabase.table("files").select(
         "id").eq("id", str(file_id)).execute()
@@ -107,44 +205,142 @@ def check_file_id(file_id):
     return True
 
 
+@lru_cache(maxsize=1)
+def get_splitter() -> RecursiveCharacterTextSplitter:
+    # TODO: Determine best chunk_size and chunk_overlap
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name="cl100k_base",
+        chunk_size=500,
+        chunk_overlap=100,
+        add_start_index=True,
+    )
+
+
+def load_and_split(ext: str, path: Path) -> list:
+    """Parse the file at `path` with the loader for `ext` and split it into chunks (blocking)."""
+    with metrics.span("parse"):
+        documents = SUPPORTED_TYPES[ext](path).load()
+    with metrics.span("split"):
+        return get_splitter().split_documents(documents)
+
+
 def _batched(seq, n):
     for i in range(0, len(seq), n):
         yield seq[i:i+n]
 
 
-def save_chunks_and_embeddings(file_id, chunks):
-    # Prepare rows and texts (preserve order by chunk_index)
+def save_chunks_and_embeddings(file_id, chunks, space=DEFAULT_SPACE):
+    errors = save_files_chunks_and_embeddings({file_id: chunks}, space)
+    if file_id in errors:
+        raise errors[file_id]
+
+
+def save_files_chunks_and_embeddings(file_chunks: Dict[str, list], space: str = DEFAULT_SPACE) -> Dict[str, Exception]:
+    """
+    Store chunks and their embeddings (in embedding `space`) for any number
+    of files. Rows from all files are packed into full DB_BATCH inserts and
+    full EMB_BATCH embedding requests. Returns {file_id: error} for the files
+    that failed: a failed batch fails every file with rows in it, and the
+    others carry on. A file with no chunks fails too (no extractable text,
+    e.g. a scanned PDF). Chunks stored by an earlier run are replaced, and
+    failed files keep no chunks or embeddings.
+    """
+    errors: Dict[str, Exception] = {
+        file_id: RuntimeError("no extractable text")
+        for file_id, chunks in file_chunks.items() if not chunks
+    }
+    embedder = embeddings_model if space == DEFAULT_SPACE else get_embedder(space)
+
+    def fail(batch, e):
+        for r in batch:
+            errors.setdefault(r["file_id"], e)
+
+    # Re-embedding replaces a file's chunks; stale ones would be retrieved
+    # alongside the new ones (or, from another space, break the index)
+    with metrics.span("delete_chunks"):
+        try:
+            delete_chunks_and_embeddings([fid for fid in file_chunks if fid not in errors])
+        except Exception as e:
+            for fid in file_chunks:
+                errors.setdefault(fid, e)
+
+    # Prepare rows (preserve order by chunk_index)
     chunk_rows = []
-    texts = []
-    for i, chunk in enumerate(chunks):
-        content = (chunk.page_content or "").strip()
-        chunk_rows.append({
-            "file_id": file_id,
-            "content": content,
-            "chunk_index": i
-        })
-        texts.append(content)
-
-    # 1) Insert all chunks in one go (returns ids)
-    # If your client supports .select(), you can do: .select("id,chunk_index")
-    inserted = supabase.table("chunks").insert(chunk_rows).execute()
-    if not inserted.data or len(inserted.data) != len(chunk_rows):
-        raise RuntimeError("Failed to insert chunks or row count mismatch.")
-    # Map chunk_index -> generated id
-    idx_to_id = {row["chunk_index"]: row["id"] for row in inserted.data}
+    for file_id, chunks in file_chunks.items():
+        if file_id in errors:
+            continue
+        for i, chunk in enumerate(chunks):
+            chunk_rows.append({
+                "file_id": file_id,
+                "content": (chunk.page_content or "").strip(),
+                "chunk_index": i
+            })
+
+    # 1) Insert chunks (returns ids)
+    # Map (file_id, chunk_index) -> generated id
+    ids = {}
+    with metrics.span("insert_chunks"):
+        for batch in _batched(chunk_rows, DB_BATCH):
+            try:
+                inserted = supabase.table("chunks").insert(batch).execute()
+                if not inserted.data or len(inserted.data) != len(batch):
+                    raise RuntimeError("Failed to insert chunks or row count mismatch.")
+            except Exception as e:
+                fail(batch, e)
+                continue
+            for row in inserted.data:
+                ids[(row["file_id"], row["chunk_index"])] = row["id"]
 
     # 2) Embed documents in batches (NOT embed_query)
-    EMB_BATCH = 128  # tune as needed for rate limits
-    vectors = [None] * len(texts)
-    pos = 0
-    for batch in _batched(texts, EMB_BATCH):
-        vecs = embeddings_model.embed_documents(batch)  # list[list[float]]
-        vectors[pos:pos+len(vecs)] = vecs
-        pos += len(vecs)
+    pending = [r for r in chunk_rows if r["file_id"] not in errors]
+    emb_rows = []
+    with metrics.span("embed"):
+        for batch in _batched(pending, EMB_BATCH):
+            try:
+                vecs = embedder.embed_documents([r["content"] for r in batch])
+            except Exception as e:
+                fail(batch, e)
+                continue
+            emb_rows.extend(
+                {"file_id": r["file_id"], "chunk_id": ids[(r["file_id"], r["chunk_index"])], "embedding": vec}
+                for r, vec in zip(batch, vecs))
 
     # 3) Insert embeddings in batches
-    DB_BATCH = 500
-    emb_rows = [{"chunk_id": idx_to_id[i], "embedding": vec}
-                for i, vec in enumerate(vectors)]
-    for batch in _batched(emb_rows, DB_BATCH):
-        supabase.table("embeddings").insert(batch).execute()
+    emb_rows = [r for r in emb_rows if r["file_id"] not in errors]
+    with metrics.span("insert_embeddings"):
+        for batch in _batched(emb_rows, DB_BATCH):
+            try:
+                supabase.table("embeddings").insert(
+                    [{"chunk_id": r["chunk_id"], "embedding": r["embedding"]} for r in batch]).execute()
+            except Exception as e:
+                fail(batch, e)
+
+    # Don't leave half a file behind: its chunks would be retrievable without
+    # (some of) their embeddings, and a retry would duplicate them
+    if errors:
+        try:
+            delete_chunks_and_embeddings(list(errors))
+        except Exception:
+            logger.exception(f"Could not clean up chunks of failed files {list(errors)}")
+
+    return errors
+
+
+def delete_chunks_and_embeddings(file_ids: List[str]) -> None:
+    """Delete every chunk of `file_ids` and the chunks' embeddings."""
+    for file_batch in _batched(file_ids, ID_BATCH):
+        while True:
+            res = (
+                supabase.table("chunks")
+                .select("id")
+                .in_("file_id", file_batch)
+                .limit(DB_BATCH)
+                .execute()
+            )
+            chunk_ids = [r["id"] for r in res.data or []]
+            if not chunk_ids:
+                break
+            for id_batch in _batched(chunk_ids, ID_BATCH):
+                # Embeddings first: they reference their chunk
+                supabase.table("embeddings").delete().in_("chunk_id", id_batch).execute()
+                supabase.table("chunks").delete().in_("id", id_batch).execute()
@@ -0,0 +1,70 @@
+import os
+from functools import lru_cache
+
+import httpx
+import openai
+from supabase import Client, ClientOptions, create_client
+from langchain_openai import OpenAIEmbeddings
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY_SEC = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SEC", "60"))
+HTTP_CONNECT_TIMEOUT_SEC = float(os.getenv("HTTP_CONNECT_TIMEOUT_SEC", "5"))
+HTTP_TIMEOUT_SEC = float(os.getenv("HTTP_TIMEOUT_SEC", "60"))
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SEC,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(HTTP_TIMEOUT_SEC, connect=HTTP_CONNECT_TIMEOUT_SEC)
+
+
+# -------------------- OpenAI --------------------
+
+@lru_cache(maxsize=None)
+def openai_http_client() -> httpx.Client:
+    """Process-wide keep-alive pool for every sync OpenAI call."""
+    return openai.DefaultHttpxClient(http2=HTTP2_ENABLED, limits=_limits(), timeout=_timeout())
+
+
+@lru_cache(maxsize=None)
+def openai_async_http_client() -> httpx.AsyncClient:
+    """Process-wide keep-alive pool for async OpenAI calls."""
+    return openai.DefaultAsyncHttpxClient(http2=HTTP2_ENABLED, limits=_limits(), timeout=_timeout())
+
+
+@lru_cache(maxsize=None)
+def get_embeddings(model: str = EMBEDDING_MODEL) -> OpenAIEmbeddings:
+    # Must match the chat retriever's model: query and document vectors share a space
+    return OpenAIEmbeddings(
+        model=model,
+        http_client=openai_http_client(),
+        http_async_client=openai_async_http_client(),
+    )
+
+
+# -------------------- Supabase --------------------
+
+def create_supabase_client(url: str, key: str) -> Client:
+    """
+    Supabase client whose PostgREST calls go through a pooled HTTP/2 client
+    with our limits/timeouts. postgrest re-points base_url on the client it is
+    given, so the pool is never shared with OpenAI; the services here only use
+    PostgREST, which would otherwise contend with storage/functions for it.
+    """
+    http_client = httpx.Client(
+        http2=HTTP2_ENABLED,
+        limits=_limits(),
+        timeout=_timeout(),
+        follow_redirects=True,
+    )
+    return create_client(url, key, options=ClientOptions(httpx_client=http_client))
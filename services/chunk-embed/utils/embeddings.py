@@ -0,0 +1,156 @@
+"""
+Embedding backends and the bookkeeping that keeps a project's query and
+document vectors comparable.
+
+An *embedding space* names the model that produced a vector, as
+"<backend>:<model>" (e.g. "openai:text-embedding-3-small"). A project picks
+its backend with `project.embedding_backend` ("openai" or "onnx"; unset means
+EMBEDDING_BACKEND). chunk-embed stamps each file it embeds with the space it
+used (`files.embedding_space`; unset means LEGACY_SPACE), and the chat
+retriever only indexes files whose space matches the one it embeds queries
+with. Switching a project's backend therefore hides its files until they are
+re-embedded instead of silently scoring vectors from different models.
+
+This module is duplicated in chat and chunk-embed; keep the copies in sync.
+"""
+import logging
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utils.clients import EMBEDDING_MODEL, get_embeddings
+
+logger = logging.getLogger("virtual_ta")
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+# ONNX export of a sentence-transformers model: <root>/<model>/{model.onnx,tokenizer.json}
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+LOCAL_EMBEDDING_MODEL_ROOT = os.getenv("LOCAL_EMBEDDING_MODEL_ROOT", "models")
+LOCAL_EMBEDDING_BATCH = int(os.getenv("LOCAL_EMBEDDING_BATCH", "32"))
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", "0"))  # 0 = one per core
+LOCAL_EMBEDDING_MAX_TOKENS = int(os.getenv("LOCAL_EMBEDDING_MAX_TOKENS", "256"))
+
+# Files embedded before spaces were recorded
+LEGACY_SPACE = "openai:text-embedding-3-small"
+
+BACKEND_MODELS = {
+    "openai": EMBEDDING_MODEL,
+    "onnx": LOCAL_EMBEDDING_MODEL,
+}
+
+
+def embedding_space(backend: Optional[str] = None) -> str:
+    """Space that `backend` (default EMBEDDING_BACKEND) embeds into."""
+    backend = backend or EMBEDDING_BACKEND
+    if backend not in BACKEND_MODELS:
+        logger.warning(f"Unknown embedding backend {backend!r}; using {EMBEDDING_BACKEND!r}")
+        backend = EMBEDDING_BACKEND
+    return f"{backend}:{BACKEND_MODELS[backend]}"
+
+
+DEFAULT_SPACE = embedding_space()
+
+
+def file_embedding_space(file_row: dict) -> str:
+    return file_row.get("embedding_space") or LEGACY_SPACE
+
+
+def project_embedding_space(supabase, project_id: str) -> str:
+    # select("*") so projects without the embedding_backend column still work
+    res = supabase.table("project").select("*").eq("id", str(project_id)).execute()
+    row = (res.data or [{}])[0]
+    return embedding_space(row.get("embedding_backend"))
+
+
+def space_columns(space: str) -> dict:
+    """`files` columns recording `space`; empty for LEGACY_SPACE (the column default)."""
+    return {} if space == LEGACY_SPACE else {"embedding_space": space}
+
+
+@lru_cache(maxsize=None)
+def get_embedder(space: str) -> Embeddings:
+    backend, _, model = space.partition(":")
+    if backend == "openai":
+        return get_embeddings(model)
+    if backend == "onnx":
+        return OnnxEmbeddings(
+            Path(LOCAL_EMBEDDING_MODEL_ROOT) / model,
+            batch_size=LOCAL_EMBEDDING_BATCH,
+            threads=LOCAL_EMBEDDING_THREADS,
+            max_tokens=LOCAL_EMBEDDING_MAX_TOKENS,
+        )
+    raise ValueError(f"Unknown embedding space: {space}")
+
+
+# -------------------- local CPU backend --------------------
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Sentence-transformers encoder on ONNX Runtime's CPU provider: mean pooling
+    over the attention mask, then L2 normalisation.
+
+    Texts are tokenized in Rust (`encode_batch`), sorted by length and run in
+    `batch_size` batches so each batch pads only to its own longest text.
+    One session serves every thread: ONNX Runtime releases the GIL in
+    `run()` and parallelises each batch over `threads` intra-op threads.
+    """
+
+    def __init__(self, model_dir, *, batch_size: int = 32, threads: int = 0, max_tokens: int = 256):
+        # Optional dependencies: only needed when a project uses this backend
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = Path(model_dir)
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        opts.inter_op_num_threads = 1
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+        self._session = ort.InferenceSession(
+            str(model_dir / "model.onnx"), sess_options=opts, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self._session.get_inputs()}
+
+        self._tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length=max_tokens)
+        self._tokenizer.no_padding()
+        self._batch_size = max(1, int(batch_size))
+
+    def _run(self, texts: List[str]) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(texts)
+        width = max(1, max(len(e.ids) for e in encodings))
+        ids = np.zeros((len(encodings), width), dtype=np.int64)
+        mask = np.zeros((len(encodings), width), dtype=np.int64)
+        for i, e in enumerate(encodings):
+            ids[i, :len(e.ids)] = e.ids
+            mask[i, :len(e.ids)] = e.attention_mask
+
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(ids)
+        out = self._session.run(None, feeds)[0]
+
+        if out.ndim == 3:  # token embeddings -> mean pool
+            m = mask[..., None].astype(np.float32)
+            out = (out * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1e-9)
+        out = out.astype(np.float32, copy=False)
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        for start in range(0, len(order), self._batch_size):
+            idxs = order[start:start + self._batch_size]
+            for i, vec in zip(idxs, self._run([texts[i] or "" for i in idxs])):
+                vectors[i] = vec.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._run([text or ""])[0].tolist()
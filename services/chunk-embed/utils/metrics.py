@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "").lower() in ("1", "true", "yes", "on")
+
+# Seconds; spans range from single inserts to multi-minute PDF ingests
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_NULL_SPAN = nullcontext()
+
+
+class Histogram:
+    """Minimal Prometheus histogram with a single `stage` label."""
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # stage -> (per-bucket counts, sum, count)
+        self._series: Dict[str, Tuple[List[int], float, int]] = {}
+
+    def observe(self, stage: str, seconds: float) -> None:
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            counts, total, n = self._series.get(stage) or ([0] * len(self.buckets), 0.0, 0)
+            if i < len(counts):
+                counts[i] += 1
+            self._series[stage] = (counts, total + seconds, n + 1)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: (list(c), s, n) for k, (c, s, n) in self._series.items()}
+        for stage in sorted(series):
+            counts, total, n = series[stage]
+            cumulative = 0
+            for le, c in zip(self.buckets, counts):
+                cumulative += c
+                lines.append(f'{self.name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{stage="{stage}",le="+Inf"}} {n}')
+            lines.append(f'{self.name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{self.name}_count{{stage="{stage}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "squawk_embed_stage_seconds", "Latency of embedding request stages in seconds")
+
+_REGISTRY: List[Histogram] = [STAGE_SECONDS]
+
+# Per-request list of (stage, seconds); a list so copies of the context
+# (thread pools) still append to the same request.
+_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("stage_timings", default=None)
+
+
+def register(histogram: Histogram) -> Histogram:
+    _REGISTRY.append(histogram)
+    return histogram
+
+
+def begin_request() -> List[Tuple[str, float]]:
+    """Start collecting stage timings for the current request."""
+    timings: List[Tuple[str, float]] = []
+    _timings.set(timings)
+    return timings
+
+
+def bind(timings: Optional[List[Tuple[str, float]]]) -> None:
+    """Re-attach a request's timings, e.g. inside a streaming generator."""
+    _timings.set(timings)
+
+
+def record(stage: str, seconds: float) -> None:
+    if not METRICS_ENABLED:
+        return
+    STAGE_SECONDS.observe(stage, seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def _timed(stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+
+def span(stage: str):
+    """Time a block as `stage`; a shared no-op context when metrics are off."""
+    return _timed(stage) if METRICS_ENABLED else _NULL_SPAN
+
+
+def server_timing(timings: Optional[List[Tuple[str, float]]]) -> str:
+    """Render timings as a `Server-Timing` value, summing repeated stages."""
+    if not timings:
+        return ""
+    totals: Dict[str, float] = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+def render_metrics() -> str:
+    return "".join(h.render() for h in _REGISTRY)
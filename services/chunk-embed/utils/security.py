@@ -43,7 +43,7 @@ def get_user_id_from_request(request: Request) -> str:
             status_code=401, detail="Invalid token: missing sub")
     return sub
 
-def assert_file_owned(supabase, file_id: str, user_id: str) -> None:
+def assert_file_owned(supabase, file_id: str, user_id: str) -> str:
     # files.project_id -> project.id; enforce project.owner_id = user_id
     res = supabase.table("files").select(
         "id, project!inner(id, owner_id)"
@@ -51,4 +51,18 @@ def assert_file_owned(supabase, file_id: str, user_id: str) -> None:
 
     if not res.data:
         raise HTTPException(
-            status_code=404, detail="File not found or unauthorized")
\ No newline at end of file
+            status_code=404, detail="File not found or unauthorized")
+    return res.data[0]["project"]["id"]
+
+def assert_files_owned(supabase, project_id: str, file_ids, user_id: str) -> None:
+    # Every file must belong to `project_id`, owned by user_id; one round trip
+    res = supabase.table("files").select(
+        "id, project!inner(id, owner_id)"
+    ).in_("id", [str(f) for f in file_ids]).eq(
+        "project.id", str(project_id)).eq("project.owner_id", user_id).execute()
+
+    found = {str(row["id"]) for row in (res.data or [])}
+    missing = [str(f) for f in file_ids if str(f) not in found]
+    if missing:
+        raise HTTPException(
+            status_code=404, detail=f"File not found or unauthorized: {', '.join(missing)}")
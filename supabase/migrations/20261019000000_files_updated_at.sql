@@ -0,0 +1,21 @@
+-- files.updated_at versions a project's indexed file set: the chat service's
+-- answer cache and index refresh compare it to spot re-embedded files.
+-- chunk-embed only updates status, so keep the column current with a trigger.
+
+alter table public.files
+  add column if not exists updated_at timestamptz not null default now();
+
+create or replace function public.set_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.updated_at = now();
+  return new;
+end;
+$$;
+
+drop trigger if exists files_set_updated_at on public.files;
+create trigger files_set_updated_at
+  before update on public.files
+  for each row execute function public.set_updated_at();
@@ -0,0 +1,18 @@
+-- Embedding spaces: a project may embed with OpenAI (1536-d) or the local
+-- ONNX encoder (384-d), see services/*/utils/embeddings.py.
+
+-- Backend a project embeds with ("openai" | "onnx"); null = EMBEDDING_BACKEND
+alter table public.project
+  add column if not exists embedding_backend text;
+
+-- Space a file's chunks were embedded in; null = "openai:text-embedding-3-small"
+alter table public.files
+  add column if not exists embedding_space text;
+
+-- A vector(1536) column rejects 384-d rows. Drop the fixed dimension so each
+-- row keeps its model's own; the chat service searches in process and only
+-- compares vectors of the project's active space. Any ANN index on this
+-- column needs a fixed dimension and must be dropped first (no service
+-- queries through one).
+alter table public.embeddings
+  alter column embedding type vector using embedding::vector;
@@ -25,6 +25,17 @@ export async function POST(req: NextRequest) {
     return new Response("Something went wrong.", { status: 502 });
   }
 
+  // Load shedding: pass the status and Retry-After through so clients back off
+  if (upstream.status === 429 || upstream.status === 503) {
+    const headers: Record<string, string> = {};
+    const retryAfter = upstream.headers.get("Retry-After");
+    if (retryAfter) headers["Retry-After"] = retryAfter;
+    return new Response("The assistant is busy right now. Please try again shortly.", {
+      status: upstream.status,
+      headers,
+    });
+  }
+
   if (!upstream.ok || !upstream.body) {
     return new Response("Something went wrong.", { status: 502 });
   }
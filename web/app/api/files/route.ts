@@ -57,6 +57,9 @@ export async function POST(req: NextRequest) {
   }
 
   const uploadedPaths = [];
+  // Embedded together in one bulk request once every upload is registered
+  const embedFileIds: string[] = [];
+  const embedFiles: File[] = [];
 
   for (const file of files) {
     if (!(file instanceof File)) continue;
@@ -90,26 +93,8 @@ export async function POST(req: NextRequest) {
       return NextResponse.json({ error: "Failed to register file metadata" }, { status: 500 });
     }
 
-    const embeddingUrl = process.env.EMBEDDING_SERVICE_URL
-
-    let token: string;
-    try {
-      token = await mintEmbeddingToken(session.user.id);
-    } catch (e: unknown) {
-      // roll back status so UI can retry
-      await supabase.from("files").update({ status: "error" }).eq("id", data.id);
-      return NextResponse.json({ error: `Token mint failed: ${(e as Error)?.message || e}` }, { status: 500 });
-    }
-
-    const formData = new FormData();
-    formData.append("file_id", data.id);
-    formData.append("file", file);
-
-    fetch(`${embeddingUrl}`, {
-      method: "POST",
-      headers: { Authorization: `Bearer ${token}` },
-      body: formData,
-    })
+    embedFileIds.push(data.id);
+    embedFiles.push(file);
 
     uploadedPaths.push({
       id: data.id,
@@ -123,5 +108,34 @@ export async function POST(req: NextRequest) {
     });
   }
 
+  if (embedFileIds.length > 0) {
+    const embeddingUrl = process.env.EMBEDDING_SERVICE_URL
+
+    let token: string;
+    try {
+      token = await mintEmbeddingToken(session.user.id);
+    } catch (e: unknown) {
+      // roll back status so UI can retry
+      await supabase.from("files").update({ status: "error" }).in("id", embedFileIds);
+      return NextResponse.json({ error: `Token mint failed: ${(e as Error)?.message || e}` }, { status: 500 });
+    }
+
+    // chunk-embed accepts at most BULK_MAX_FILES (50) files per bulk request
+    for (let start = 0; start < embedFileIds.length; start += 50) {
+      const formData = new FormData();
+      formData.append("project_id", projectId as string);
+      for (let i = start; i < Math.min(start + 50, embedFileIds.length); i++) {
+        formData.append("file_ids", embedFileIds[i]);
+        formData.append("files", embedFiles[i]);
+      }
+
+      fetch(`${embeddingUrl?.replace(/\/$/, "")}/bulk`, {
+        method: "POST",
+        headers: { Authorization: `Bearer ${token}` },
+        body: formData,
+      })
+    }
+  }
+
   return NextResponse.json({ messsage: 'success', paths: uploadedPaths }, { status: 200 });
 };